@@ -0,0 +1,135 @@
+import os
+import json
+import sqlite3
+import threading
+
+
+class AssetIndex:
+    def __init__(self, path: str = "chromaDB/asset_index.sqlite3"):
+        """
+        Local copy of the Knowledge articles fields and of the links between
+        ContentDocuments and articles, filled at ingest so search results can
+        be joined with their assets without calling Salesforce.
+
+        Parameters:
+            path (str): Path of the SQLite file holding the index.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS assets (id TEXT PRIMARY KEY, fields TEXT)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS links ("
+            "content_document_id TEXT, asset_id TEXT, "
+            "PRIMARY KEY (content_document_id, asset_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS links_asset ON links (asset_id)")
+        self._db.commit()
+
+    def count(self):
+        """
+        Return the number of articles in the index.
+        """
+
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+
+    def asset_ids(self, ids):
+        """
+        Return the IDs among ids that are indexed articles.
+
+        Parameters:
+            ids (List[str]): Salesforce records IDs.
+        """
+
+        ids = list(ids)
+        with self._lock:
+            rows = []
+            for start in range(0, len(ids), 500):
+                batch = ids[start : start + 500]
+                placeholders = ", ".join("?" for _ in batch)
+                rows += self._db.execute(
+                    f"SELECT id FROM assets WHERE id IN ({placeholders})", batch
+                ).fetchall()
+        return {row[0] for row in rows}
+
+    def upsert_assets(self, records, links):
+        """
+        Add or replace articles and all their links.
+
+        Parameters:
+            records (List[dict]): Knowledge articles fields, with their Id.
+            links (List[tuple]): (ContentDocumentId, article Id) pairs of the
+                articles.
+        """
+
+        ids = [(record["Id"],) for record in records]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO assets VALUES (?, ?)",
+                [(record["Id"], json.dumps(record)) for record in records],
+            )
+            self._db.executemany("DELETE FROM links WHERE asset_id = ?", ids)
+            self._db.executemany("INSERT OR IGNORE INTO links VALUES (?, ?)", links)
+            self._db.commit()
+
+    def set_document_links(self, content_document_ids, links):
+        """
+        Replace the article links of ContentDocuments.
+
+        Parameters:
+            content_document_ids (List[str]): ContentDocuments IDs.
+            links (List[tuple]): (ContentDocumentId, article Id) pairs of the
+                documents.
+        """
+
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM links WHERE content_document_id = ?",
+                [(id,) for id in content_document_ids],
+            )
+            self._db.executemany("INSERT OR IGNORE INTO links VALUES (?, ?)", links)
+            self._db.commit()
+
+    def delete(self, ids):
+        """
+        Delete articles and their links.
+
+        Parameters:
+            ids (List[str]): Articles IDs.
+        """
+
+        ids = [(id,) for id in ids]
+        with self._lock:
+            self._db.executemany("DELETE FROM assets WHERE id = ?", ids)
+            self._db.executemany("DELETE FROM links WHERE asset_id = ?", ids)
+            self._db.commit()
+
+    def assets_by_document(self, content_document_ids):
+        """
+        Return {ContentDocumentId: article fields} for the documents linked
+        to an indexed article.
+
+        Parameters:
+            content_document_ids (List[str]): ContentDocuments IDs.
+        """
+
+        content_document_ids = list(content_document_ids)
+        if not content_document_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in content_document_ids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT links.content_document_id, assets.fields FROM links "
+                "JOIN assets ON assets.id = links.asset_id "
+                f"WHERE links.content_document_id IN ({placeholders}) "
+                "ORDER BY links.rowid",
+                content_document_ids,
+            ).fetchall()
+        return {document_id: json.loads(fields) for document_id, fields in rows}
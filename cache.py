@@ -0,0 +1,391 @@
+import os
+import re
+import time
+import zlib
+import tempfile
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class TextCache:
+    def __init__(
+        self,
+        path: str = "cache/text_cache.sqlite3",
+        max_size_mb: int = 1024,
+    ):
+        """
+        On-disk cache of extracted text keyed by record Id and version
+        (e.g. the ContentVersion Checksum). Text is stored compressed and the
+        least recently used entries are evicted once the cache grows over
+        max_size_mb.
+
+        Parameters:
+            path (str): Path of the SQLite file holding the cache.
+            max_size_mb (int): Maximum size of the cached text in MB.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS texts ("
+            "id TEXT, version TEXT, text BLOB, size INTEGER, accessed REAL, "
+            "PRIMARY KEY (id, version))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS texts_accessed ON texts (accessed)"
+        )
+        self._db.commit()
+        self._size = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM texts"
+        ).fetchone()[0]
+
+    def get(self, id: str, version: str = ""):
+        """
+        Return the cached text of the record, or None on a miss.
+
+        Parameters:
+            id (str): Salesforce record ID.
+            version (str): Version of the record content.
+        """
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text FROM texts WHERE id = ? AND version = ?",
+                (id, version),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                "UPDATE texts SET accessed = ? WHERE id = ? AND version = ?",
+                (time.time(), id, version),
+            )
+            self._db.commit()
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, id: str, text: str, version: str = ""):
+        """
+        Store the text of the record, replacing any older version of it.
+
+        Parameters:
+            id (str): Salesforce record ID.
+            text (str): Extracted text.
+            version (str): Version of the record content.
+        """
+
+        blob = zlib.compress(text.encode("utf-8"))
+        with self._lock:
+            self._size -= self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM texts WHERE id = ?", (id,)
+            ).fetchone()[0]
+            self._db.execute("DELETE FROM texts WHERE id = ?", (id,))
+            self._db.execute(
+                "INSERT INTO texts VALUES (?, ?, ?, ?, ?)",
+                (id, version, blob, len(blob), time.time()),
+            )
+            self._size += len(blob)
+            self._evict()
+            self._db.commit()
+
+    def delete(self, id: str):
+        """
+        Drop every cached version of the record.
+
+        Parameters:
+            id (str): Salesforce record ID.
+        """
+
+        with self._lock:
+            self._size -= self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM texts WHERE id = ?", (id,)
+            ).fetchone()[0]
+            self._db.execute("DELETE FROM texts WHERE id = ?", (id,))
+            self._db.commit()
+
+    def _evict(self):
+        while self._size > self.max_size:
+            rows = self._db.execute(
+                "SELECT rowid, size FROM texts ORDER BY accessed LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            for rowid, size in rows:
+                if self._size <= self.max_size:
+                    break
+                self._db.execute("DELETE FROM texts WHERE rowid = ?", (rowid,))
+                self._size -= size
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = None):
+        """
+        Thread-safe in-memory cache evicting the least recently used entries
+        beyond max_size, and entries older than ttl seconds.
+
+        Parameters:
+            max_size (int): Maximum number of entries.
+            ttl (float): Seconds an entry stays valid, None to keep it until evicted.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the cached value of key, or default on a miss.
+
+        Parameters:
+            key: Cache key.
+            default: Value returned on a miss.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.monotonic() - entry[1] < self.ttl
+            ):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """
+        Store value under key.
+
+        Parameters:
+            key: Cache key.
+            value: Value to cache.
+        """
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop every entry.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return the size and hit rate of the cache.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class BlobCache:
+    def __init__(self, path: str = "cache/blobs", max_size_mb: int = 2048):
+        """
+        On-disk cache of downloaded files keyed by ContentVersion Id, which
+        never changes content. Files are written atomically (temporary file
+        then rename) and the least recently used ones are evicted once the
+        cache grows over max_size_mb.
+
+        Parameters:
+            path (str): Directory holding the cached files.
+            max_size_mb (int): Maximum size of the cached files in MB.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_size = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        files = []
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if name.endswith(".tmp"):
+                os.remove(file_path)
+                continue
+            stat = os.stat(file_path)
+            files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+        self._size = sum(self._entries.values())
+
+    def _name(self, id: str):
+        return re.sub(r"[^A-Za-z0-9_-]", "_", id)
+
+    def get_path(self, id: str):
+        """
+        Return the path of the cached file, or None on a miss.
+
+        Parameters:
+            id (str): ContentVersion ID.
+        """
+
+        name = self._name(id)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(name)
+        file_path = os.path.join(self.path, name)
+        try:
+            # The modification time keeps the LRU order across restarts.
+            os.utime(file_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+        return file_path
+
+    def get(self, id: str):
+        """
+        Return the cached file content, or None on a miss.
+
+        Parameters:
+            id (str): ContentVersion ID.
+        """
+
+        file_path = self.get_path(id)
+        if file_path is None:
+            return None
+        with open(file_path, "rb") as f:
+            return f.read()
+
+    def put(self, id: str, data: bytes):
+        """
+        Store the file content.
+
+        Parameters:
+            id (str): ContentVersion ID.
+            data (bytes): File content.
+        """
+
+        writer = self.writer(id)
+        writer.write(data)
+        writer.commit()
+
+    def writer(self, id: str):
+        """
+        Return a BlobWriter filling the cache entry chunk by chunk, e.g.
+        while the file is streamed to a client.
+
+        Parameters:
+            id (str): ContentVersion ID.
+        """
+
+        return BlobWriter(self, self._name(id))
+
+    def _add(self, name: str, size: int):
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._size += size
+            while self._size > self.max_size and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                try:
+                    os.remove(os.path.join(self.path, evicted))
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, id: str):
+        """
+        Drop the cached file.
+
+        Parameters:
+            id (str): ContentVersion ID.
+        """
+
+        name = self._name(id)
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """
+        Return the size and hit rate of the cache.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._entries),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class BlobWriter:
+    def __init__(self, cache: BlobCache, name: str):
+        """
+        Temporary file becoming a BlobCache entry on commit, so a partial
+        download is never served.
+
+        Parameters:
+            cache (BlobCache): Cache receiving the file.
+            name (str): Entry name.
+        """
+
+        self.cache = cache
+        self.name = name
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.path, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """
+        Move the complete file into the cache.
+        """
+
+        self._file.close()
+        if self.size > self.cache.max_size:
+            os.remove(self.tmp_path)
+            return
+        os.replace(self.tmp_path, os.path.join(self.cache.path, self.name))
+        self.cache._add(self.name, self.size)
+
+    def discard(self):
+        """
+        Drop the temporary file.
+        """
+
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+from embeddings import OnnxEmbeddingFunction, parity_check
+
+MODEL_NAME = "intfloat/multilingual-e5-base"
+
+SAMPLE_TEXTS = [
+    "How do I reset my password?",
+    "Quarterly revenue grew by 12% compared to the previous year.",
+    "كيف يمكنني تقديم طلب إجازة؟",
+    "La facture doit être payée dans les trente jours.",
+    "The onboarding checklist covers laptop setup, accounts and training.",
+    "Bitte senden Sie den unterschriebenen Vertrag bis Freitag zurück.",
+    "Incident report: the VPN gateway was unreachable for 20 minutes.",
+    "Employees are entitled to 30 days of annual leave per year.",
+]
+
+
+def torch_embedding_function(batch_size: int = 32):
+    """
+    The PyTorch path, as the SentenceTransformer model computes it.
+    """
+
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(MODEL_NAME, device="cpu")
+    return lambda texts: model.encode(texts, batch_size=batch_size).tolist()
+
+
+def export(output: str, quantize: bool = True):
+    """
+    Export the model to ONNX with its tokenizer, and an int8 dynamically
+    quantized copy (model_quantized.onnx).
+
+    Parameters:
+        output (str): Directory receiving the export.
+        quantize (bool): Also write the int8 model.
+    """
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModel.from_pretrained(MODEL_NAME).eval()
+    tokenizer.save_pretrained(output)
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    model_file = os.path.join(output, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            model_file,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "tokens"},
+                "attention_mask": {0: "batch", 1: "tokens"},
+                "last_hidden_state": {0: "batch", 1: "tokens"},
+            },
+            opset_version=14,
+        )
+    if quantize:
+        quantize_dynamic(
+            model_file,
+            os.path.join(output, "model_quantized.onnx"),
+            weight_type=QuantType.QInt8,
+        )
+
+
+def load_texts(path: str = None):
+    if not path:
+        return SAMPLE_TEXTS
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _measure(backend: str, model_path: str, model_file: str, texts, queue):
+    started = time.perf_counter()
+    if backend == "torch":
+        embed = torch_embedding_function()
+    else:
+        embed = OnnxEmbeddingFunction(model_path, model_file=model_file)
+    load_seconds = time.perf_counter() - started
+
+    latencies = []
+    for text in texts[:50]:
+        started = time.perf_counter()
+        embed([text])
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    started = time.perf_counter()
+    embed(texts)
+    seconds = time.perf_counter() - started
+
+    queue.put(
+        {
+            "backend": backend if backend == "torch" else model_file,
+            "load_seconds": round(load_seconds, 3),
+            "query_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+            "query_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 2),
+            "chunks_per_second": round(len(texts) / seconds, 1),
+            "max_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+        }
+    )
+
+
+def benchmark(model_path: str, model_files, texts):
+    """
+    Measure load time, single query latency, batch throughput and peak RSS
+    of the PyTorch path and of each ONNX model, each in its own process so
+    the RSS figures do not mix.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend, model_file in [("torch", None)] + [
+        ("onnx", model_file) for model_file in model_files
+    ]:
+        queue = context.Queue()
+        process = context.Process(
+            target=_measure, args=(backend, model_path, model_file, texts, queue)
+        )
+        process.start()
+        results.append(queue.get())
+        process.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export, check and benchmark the ONNX embedding backend."
+    )
+    parser.add_argument("command", choices=["export", "parity", "benchmark"])
+    parser.add_argument("--model-path", default="models/multilingual-e5-base-onnx")
+    parser.add_argument(
+        "--model-file",
+        action="append",
+        help="ONNX model file(s) in model-path, default model_quantized.onnx",
+    )
+    parser.add_argument("--texts", help="File with one sample text per line.")
+    parser.add_argument("--tolerance", type=float, default=0.01)
+    args = parser.parse_args()
+    model_files = args.model_file or ["model_quantized.onnx"]
+
+    if args.command == "export":
+        export(args.model_path)
+    elif args.command == "parity":
+        reference = torch_embedding_function()
+        texts = load_texts(args.texts)
+        passed = True
+        for model_file in model_files:
+            candidate = OnnxEmbeddingFunction(args.model_path, model_file=model_file)
+            stats, ok = parity_check(reference, candidate, texts, args.tolerance)
+            print(json.dumps({"model_file": model_file, **stats, "passed": ok}))
+            passed = passed and ok
+        sys.exit(0 if passed else 1)
+    else:
+        for result in benchmark(args.model_path, model_files, load_texts(args.texts)):
+            print(json.dumps(result))
@@ -0,0 +1,304 @@
+import os
+import time
+import logging
+import numpy as np
+import onnxruntime
+import threading
+import multiprocessing
+from tokenizers import Tokenizer
+from concurrent.futures import ProcessPoolExecutor
+
+
+class LazyEmbeddingFunction:
+    def __init__(self, factory):
+        """
+        Embedding function built on first use, so creating the vector store
+        does not load the model.
+
+        Parameters:
+            factory: Callable returning the embedding function.
+        """
+
+        self.factory = factory
+        self._function = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._function is not None
+
+    def load(self):
+        """
+        Build the embedding function if it is not built yet and return it.
+        """
+
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    self._function = self.factory()
+        return self._function
+
+    def __call__(self, input):
+        return self.load()(input)
+
+
+_model = None
+
+
+def _init_worker(model_name: str, device: str, threads: int):
+    global _model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(threads)
+    _model = SentenceTransformer(model_name, device=device)
+
+
+def _encode(texts):
+    return _model.encode(texts, batch_size=len(texts), convert_to_numpy=True).tolist()
+
+
+class EmbeddingEngine:
+    def __init__(
+        self,
+        model_name: str = "intfloat/multilingual-e5-base",
+        workers: int = None,
+        batch_size: int = 32,
+        device: str = "cpu",
+    ):
+        """
+        Embedding function encoding with a pool of worker processes, each
+        holding its own copy of the SentenceTransformer model and an equal
+        share of the cores. Texts are sorted by length before being cut into
+        batches, so each batch pads to a similar length. Meant for bulk
+        writes: batches run first in, first out, so a single query would wait
+        behind every batch queued before it. The workers start on the first
+        call and close stops them, so the model copies only live during a
+        write pass.
+
+        Parameters:
+            model_name (str): SentenceTransformer model name.
+            workers (int): Number of worker processes.
+                Default value: number of CPUs, at most 4.
+            batch_size (int): Number of texts encoded at once by a worker.
+            device (str): Torch device of the workers.
+        """
+
+        self.model_name = model_name
+        self.workers = workers if workers else min(os.cpu_count(), 4)
+        self.batch_size = batch_size
+        self.chunks = 0
+        self.seconds = 0.0
+        self.device = device
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                threads = max(1, os.cpu_count() // self.workers)
+                self._pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.device, threads),
+                )
+            return self._pool
+
+    def __call__(self, input):
+        started = time.perf_counter()
+        order = sorted(range(len(input)), key=lambda i: len(input[i]))
+        batches = [
+            order[start : start + self.batch_size]
+            for start in range(0, len(order), self.batch_size)
+        ]
+        embeddings = [None] * len(input)
+        results = self._get_pool().map(
+            _encode, [[input[i] for i in batch] for batch in batches]
+        )
+        for batch, vectors in zip(batches, results):
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.chunks += len(input)
+            self.seconds += elapsed
+        if len(input) > self.batch_size:
+            logging.debug(
+                f"embedded {len(input)} chunks in {elapsed:.2f}s: "
+                f"{len(input) / max(elapsed, 1e-9):.1f} chunks/s"
+            )
+        return embeddings
+
+    def warm_up(self):
+        """
+        Start the worker processes and load the model in them.
+        """
+
+        list(self._get_pool().map(_encode, [[""]] * self.workers))
+
+    def stats(self):
+        """
+        Return the number of chunks embedded and the throughput so far.
+        """
+
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "seconds": round(self.seconds, 3),
+                "chunks_per_second": (
+                    self.chunks / self.seconds if self.seconds else 0.0
+                ),
+            }
+
+    def report(self):
+        """
+        Log the embedding throughput so far.
+        """
+
+        stats = self.stats()
+        logging.info(
+            f"embedded {stats['chunks']} chunks in {stats['seconds']}s: "
+            f"{stats['chunks_per_second']:.1f} chunks/s "
+            f"({self.workers} workers, batches of {self.batch_size})"
+        )
+
+    def close(self):
+        """
+        Stop the worker processes, freeing their model copies. The next call
+        starts them again.
+        """
+
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+
+class OnnxEmbeddingFunction:
+    def __init__(
+        self,
+        model_path: str = "models/multilingual-e5-base-onnx",
+        model_file: str = "model_quantized.onnx",
+        batch_size: int = 32,
+        max_length: int = 512,
+        threads: int = None,
+        normalize: bool = True,
+    ):
+        """
+        Embedding function running a local ONNX (optionally int8 quantized)
+        export of the e5 model with ONNX Runtime on CPU: mean pooling over
+        the tokens, then L2 normalisation, like the SentenceTransformer
+        pipeline. See embedding_benchmark.py to export, check and compare it.
+
+        Parameters:
+            model_path (str): Directory holding the ONNX model and tokenizer.json.
+            model_file (str): File name of the ONNX model in model_path.
+            batch_size (int): Number of texts encoded at once.
+            max_length (int): Maximum number of tokens per text.
+            threads (int): ONNX Runtime intra-op threads. Default value: all cores.
+            normalize (bool): L2-normalise the vectors.
+        """
+
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.chunks = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_path, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._inputs = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        mask = np.array(
+            [encoding.attention_mask for encoding in encodings], dtype=np.int64
+        )
+        feed = {"input_ids": input_ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feed)[0]
+        mask = mask[:, :, None].astype(hidden.dtype)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def __call__(self, input):
+        started = time.perf_counter()
+        # Sorted by length, each batch is padded to a similar length.
+        order = sorted(range(len(input)), key=lambda i: len(input[i]))
+        embeddings = [None] * len(input)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            vectors = self._encode([input[i] for i in batch])
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector.tolist()
+        with self._lock:
+            self.chunks += len(input)
+            self.seconds += time.perf_counter() - started
+        return embeddings
+
+    def stats(self):
+        """
+        Return the number of chunks embedded and the throughput so far.
+        """
+
+        with self._lock:
+            return {
+                "chunks": self.chunks,
+                "seconds": round(self.seconds, 3),
+                "chunks_per_second": (
+                    self.chunks / self.seconds if self.seconds else 0.0
+                ),
+            }
+
+    def report(self):
+        """
+        Log the embedding throughput so far.
+        """
+
+        stats = self.stats()
+        logging.info(
+            f"embedded {stats['chunks']} chunks in {stats['seconds']}s: "
+            f"{stats['chunks_per_second']:.1f} chunks/s (onnx)"
+        )
+
+
+def parity_check(reference, candidate, texts, tolerance: float = 0.01):
+    """
+    Embed texts with both embedding functions and compare the vectors by
+    cosine distance. Return the statistics and whether the worst distance
+    is within tolerance.
+
+    Parameters:
+        reference: Embedding function in use (e.g. the PyTorch model).
+        candidate: Embedding function checked against it.
+        texts (List[str]): Sample texts.
+        tolerance (float): Maximum cosine distance allowed.
+    """
+
+    expected = np.array(reference(texts), dtype=np.float64)
+    actual = np.array(candidate(texts), dtype=np.float64)
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    actual /= np.linalg.norm(actual, axis=1, keepdims=True)
+    distances = 1 - (expected * actual).sum(axis=1)
+    stats = {
+        "texts": len(texts),
+        "mean_cosine_distance": float(distances.mean()),
+        "max_cosine_distance": float(distances.max()),
+        "tolerance": tolerance,
+    }
+    return stats, stats["max_cosine_distance"] <= tolerance
@@ -1,13 +1,20 @@
-import io
 import os
+import re
+import asyncio
+import logging
+from warmup import WarmUp
+from sync import SyncScheduler
 from salesforce import Salesforce
 from vector_store import Vector_Store
-from fastapi import FastAPI, responses
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Request, responses
 from dotenv import load_dotenv, find_dotenv
-from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 _ = load_dotenv(find_dotenv())
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
 
 # my_knowledge__kav_createdbyid = '005Vd000001282YIAQ'
 # my_contentversion_createdbyid = '005Vd000001282YIAQ'
@@ -30,11 +37,24 @@ sf = Salesforce(
     os.getenv("CONSUMER_KEY"),
     os.getenv("CONSUMER_SECRET"),
     os.getenv("DOMAIN"),
+    pool_maxsize=int(os.getenv("SF_POOL_MAXSIZE", "10")),
+    blob_cache_max_size_mb=int(os.getenv("BLOB_CACHE_MAX_SIZE_MB", "2048")),
 )
 
 
-# Create and initialize VectorStore instance
-db = Vector_Store(sf=sf, collection_name="ContentVersion")
+# Create VectorStore instance, the embedding model loads on first use
+db = Vector_Store(
+    sf=sf,
+    collection_name="ContentVersion",
+    download_workers=int(os.getenv("INGEST_DOWNLOAD_WORKERS", "8")),
+    parse_workers=int(os.getenv("INGEST_PARSE_WORKERS", "0")) or None,
+    embedding_workers=int(os.getenv("EMBEDDING_WORKERS", "1")),
+    embedding_processes=int(os.getenv("EMBEDDING_PROCESSES", "0")) or None,
+    encode_batch_size=int(os.getenv("ENCODE_BATCH_SIZE", "32")),
+    embedding_backend=os.getenv("EMBEDDING_BACKEND", "torch"),
+    onnx_model_path=os.getenv("ONNX_MODEL_PATH", "models/multilingual-e5-base-onnx"),
+    onnx_model_file=os.getenv("ONNX_MODEL_FILE", "model_quantized.onnx"),
+)
 
 metadata_fields = [
     "Id",
@@ -43,23 +63,26 @@ metadata_fields = [
     "CreatedDate",
     "Title",
     "FileType",
+    "Checksum",
+    "FileExtension",
 ]
 
-db.init_vector_semantic(
-    metadata=metadata_fields,
-    chunk_size=600,
-    chunk_overlap=40,
-    From="ContentVersion",
-    # Where="CreatedById="'005Vd000000Zn4HIAS'",
-    Where="CreatedById='005Vd000001282YIAQ'",
-)
+# Only the latest version of each ContentDocument is ingested, older ones are
+# removed when a new version comes in.
+files_where = "CreatedById='005Vd000001282YIAQ' AND IsLatest = true"
+
+
+# Semantic and exact collections are filled from a single download pass.
+def init_files():
+    db.init_files(
+        metadata=metadata_fields,
+        chunk_size=600,
+        chunk_overlap=40,
+        From="ContentVersion",
+        # Where="CreatedById="'005Vd000000Zn4HIAS'",
+        Where=files_where,
+    )
 
-db.init_vector_exact(
-    metadata=metadata_fields,
-    From="ContentVersion",
-    # Where="CreatedById="'005Vd000000Zn4HIAS'",
-    Where="CreatedById='005Vd000001282YIAQ'",
-)
 
 metadata_assets_fields = [
     "Id",
@@ -69,56 +92,156 @@ metadata_assets_fields = [
     "Title",
     "Summary",
     "Description__c",
+    "CreatedDate",
+    "URL__c",
 ]
-db.init_vector_assets(
-    metadata=metadata_assets_fields,
-    From="Knowledge__kav",
-    Where="CreatedById='005Vd000001282YIAQ'",
-)
 
-db.init_vector_assets_exact(
-    metadata=metadata_assets_fields,
-    From="Knowledge__kav",
-    Where="CreatedById='005Vd000001282YIAQ'",
+
+def init_assets():
+    db.init_assets(
+        metadata=metadata_assets_fields,
+        From="Knowledge__kav",
+        Where="CreatedById='005Vd000001282YIAQ'",
+    )
+
+
+# Incremental sync of both sources, run every SYNC_INTERVAL seconds (0 disables).
+def sync():
+    return {
+        "files": db.sync_files(
+            metadata=metadata_fields,
+            chunk_size=600,
+            chunk_overlap=40,
+            From="ContentVersion",
+            Where=files_where,
+        ),
+        "assets": db.sync_assets(
+            metadata=metadata_assets_fields,
+            From="Knowledge__kav",
+            Where="CreatedById='005Vd000001282YIAQ'",
+        ),
+    }
+
+
+sync_scheduler = SyncScheduler(sync, interval=float(os.getenv("SYNC_INTERVAL", "0")))
+
+
+# Model loading and index initialisation run in the background, searches are
+# served from the persisted collections meanwhile.
+warm_up = WarmUp(
+    [
+        ("embedding_model", db.load_embedding_model),
+        ("files", init_files),
+        ("assets", init_assets),
+        ("sync_scheduler", sync_scheduler.start),
+    ]
 )
 
 
+@app.on_event("startup")
+def start_warm_up():
+    warm_up.start()
+
+
+@app.on_event("shutdown")
+def stop_sync_scheduler():
+    sync_scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def close_salesforce_client():
+    await sf.aclose()
+
+
 # Define home endpoints
 @app.get("/")
 def home():
     return {"message": "Welcome to the Salesforce API!"}
 
 
+# Define liveness endpoint
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok", "warm_up": warm_up.status()}
+
+
+# Define readiness endpoint
+@app.get("/readyz")
+def readyz():
+    status_code = 200 if warm_up.ready else 503
+    return responses.JSONResponse(warm_up.status(), status_code=status_code)
+
+
+def time_filters(**kwargs):
+    """
+    Build the CreatedTimestamp filter of a search, answering 422 when a date
+    is malformed.
+    """
+
+    try:
+        return db.time_filters(**kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 # Define semantic search endpoint
 @app.get("/semantic_search")
-def semantic_search(
+async def semantic_search(
     query: str,
     files_title: str = None,
     last_day: bool = False,
     last_month: bool = False,
     last_year: bool = False,
+    date_from: str = None,
+    date_to: str = None,
 ):
-    files_title_filters = db.filters(Title=files_title)
-    files_time_filters = db.time_filters(
-        last_day=last_day, last_month=last_month, last_year=last_year
-    )
-    results_dictionary = {}
-    results_dictionary["assets_results"] = db.assets_semantic_search(
-        query=query,
-        n_results=4,
-    )
-    results_dictionary["files_results"] = db.files_semantic_search(
-        query=query,
-        n_results=4,
-        max_distance=0.5,
-        # filters=files_title_filters,
-        # time_filter=files_time_filters,
+    async def search():
+        files_title_filters = db.filters(Title=files_title)
+        files_time_filters = time_filters(
+            last_day=last_day,
+            last_month=last_month,
+            last_year=last_year,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        # Embed once off the event loop, then query both collections at once.
+        await db.aembed_query(query)
+        results_dictionary = {}
+        (
+            results_dictionary["assets_results"],
+            results_dictionary["files_results"],
+        ) = await asyncio.gather(
+            asyncio.to_thread(
+                db.assets_semantic_search,
+                query=query,
+                n_results=4,
+            ),
+            asyncio.to_thread(
+                db.files_semantic_search,
+                query=query,
+                n_results=4,
+                max_distance=0.5,
+                # filters=files_title_filters,
+                time_filter=files_time_filters,
+            ),
+        )
+        # combined_results = db.combine_files_with_assets(
+        #     result_files=results_dictionary["files_results"]
+        # )
+        # return combined_results
+        return results_dictionary
+
+    return await db.acached_search(
+        "semantic_search",
+        search,
+        query,
+        files_title=files_title,
+        last_day=last_day,
+        last_month=last_month,
+        last_year=last_year,
+        date_from=date_from,
+        date_to=date_to,
     )
-    # combined_results = db.combine_files_with_assets(
-    #     result_files=results_dictionary["files_results"]
-    # )
-    # return combined_results
-    return results_dictionary
 
 
 # @app.get("/semantic_search")
@@ -153,33 +276,119 @@ def semantic_search(
 
 # Define non semantic search endpoint
 @app.get("/exact_search")
-def exact_search(
+async def exact_search(
     query: str,
     files_title: str = None,
     last_day: bool = False,
     last_month: bool = False,
     last_year: bool = False,
+    date_from: str = None,
+    date_to: str = None,
 ):
-    files_title_filters = db.filters(Title=files_title)
-    files_time_filters = db.time_filters(
-        last_day=last_day, last_month=last_month, last_year=last_year
-    )
-    results_dictionary = {}
-    results_dictionary["assets_results"] = db.assets_exact_search(
-        search_query=query,
-        n_results=4,
-    )
-    results_dictionary["files_results"] = db.files_exact_search(
-        search_query=query,
-        n_results=4,
-        # max_distance=0.5,
-        filters=files_title_filters,
-        time_filter=files_time_filters,
+    async def search():
+        files_title_filters = db.filters(Title=files_title)
+        files_time_filters = time_filters(
+            last_day=last_day,
+            last_month=last_month,
+            last_year=last_year,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        results_dictionary = {}
+        (
+            results_dictionary["assets_results"],
+            results_dictionary["files_results"],
+        ) = await asyncio.gather(
+            asyncio.to_thread(
+                db.assets_exact_search,
+                search_query=query,
+                n_results=4,
+            ),
+            asyncio.to_thread(
+                db.files_exact_search,
+                search_query=query,
+                n_results=4,
+                # max_distance=0.5,
+                filters=files_title_filters,
+                time_filter=files_time_filters,
+            ),
+        )
+        combined_results = db.combine_files_with_assets(
+            result_files=results_dictionary["files_results"]
+        )
+        return combined_results
+
+    return await db.acached_search(
+        "exact_search",
+        search,
+        query,
+        files_title=files_title,
+        last_day=last_day,
+        last_month=last_month,
+        last_year=last_year,
+        date_from=date_from,
+        date_to=date_to,
     )
-    combined_results = db.combine_files_with_assets(
-        result_files=results_dictionary["files_results"]
+
+
+# Define hybrid search endpoint
+@app.get("/hybrid_search")
+async def hybrid_search(
+    query: str,
+    files_title: str = None,
+    last_day: bool = False,
+    last_month: bool = False,
+    last_year: bool = False,
+    date_from: str = None,
+    date_to: str = None,
+):
+    async def search():
+        files_title_filters = db.filters(Title=files_title)
+        files_time_filters = time_filters(
+            last_day=last_day,
+            last_month=last_month,
+            last_year=last_year,
+            date_from=date_from,
+            date_to=date_to,
+        )
+        await db.aembed_query(query)
+        results_dictionary = {}
+        (
+            results_dictionary["assets_results"],
+            results_dictionary["files_results"],
+        ) = await asyncio.gather(
+            asyncio.to_thread(
+                db.assets_hybrid_search,
+                query=query,
+                n_results=4,
+            ),
+            asyncio.to_thread(
+                db.files_hybrid_search,
+                query=query,
+                n_results=4,
+                filters=files_title_filters,
+                time_filter=files_time_filters,
+            ),
+        )
+        return results_dictionary
+
+    return await db.acached_search(
+        "hybrid_search",
+        search,
+        query,
+        files_title=files_title,
+        last_day=last_day,
+        last_month=last_month,
+        last_year=last_year,
+        date_from=date_from,
+        date_to=date_to,
     )
-    return combined_results
+
+
+# Define cache statistics endpoint
+@app.get("/cache_stats")
+def cache_stats():
+    return {**db.cache_stats(), "blobs": sf.blobs.stats() if sf.blobs else None}
 
 
 # Define chatbot endpoint
@@ -188,28 +397,129 @@ def chatbot(query: str):
     pass
 
 
-# Define add_document endpoint
+# Define sync endpoint
+@app.post("/records/sync")
+def sync_records():
+    if not warm_up.ready:
+        return responses.JSONResponse(warm_up.status(), status_code=503)
+    return sync_scheduler.run_now()
+
+
+# Define add_document endpoint, serialised with the scheduled syncs
 @app.post("/records/add_document")
 def add_document():
-    db.add_document(From="ContentVersion", Where="CreatedById='005Vd000000Zn4HIAS'")
+    if not warm_up.ready:
+        return responses.JSONResponse(warm_up.status(), status_code=503)
+    return sync_scheduler.run_now(
+        lambda: db.add_document(
+            metadata=metadata_fields,
+            chunk_size=600,
+            chunk_overlap=40,
+            From="ContentVersion",
+            Where="CreatedById='005Vd000000Zn4HIAS' AND IsLatest = true",
+        )
+    )
 
 
-# Define delete_document endpoint
+# Define delete_document endpoint, serialised with the scheduled syncs
 @app.delete("/records/delete_document")
 def delete_document():
-    db.delete_document(From="ContentVersion", Where="CreatedById='005Vd000000Zn4HIAS'")
+    if not warm_up.ready:
+        return responses.JSONResponse(warm_up.status(), status_code=503)
+    return sync_scheduler.run_now(
+        lambda: db.delete_document(
+            From="ContentVersion",
+            Where="CreatedById='005Vd000000Zn4HIAS' AND IsLatest = true",
+        )
+    )
+
+
+def cached_file_response(path: str, range_header: str, headers: dict):
+    """
+    Serve a file of the blob cache: whole files go through FileResponse
+    (sendfile), a single 'bytes=' range is read from disk in chunks.
+    """
+
+    size = os.path.getsize(path)
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (range_header or "").strip())
+    if not match or not any(match.groups()):
+        return FileResponse(
+            path, media_type="application/octet-stream", headers=headers
+        )
+    start, end = match.groups()
+    if start:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    else:
+        start, end = max(size - int(end), 0), size - 1
+    if start > end:
+        return responses.Response(
+            status_code=416, headers={"Content-Range": f"bytes */{size}"}
+        )
+
+    async def read_range(chunk_size: int = 64 * 1024):
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    headers = {
+        **headers,
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+    }
+    return StreamingResponse(
+        read_range(),
+        status_code=206,
+        media_type="application/octet-stream",
+        headers=headers,
+    )
 
 
 # Define download records endpoint
 @app.get("/records/download")
-def download_record(id: str):
-    file_bytes = sf.get_record_by_id(id)
-    metadata = sf.get_metadata_by_id(
-        id, metadata_fields=["Title", "FileExtension"], From="ContentVersion"
-    )
+async def download_record(id: str, request: Request):
+    # File name from the local index, Salesforce only for files ingested
+    # before FileExtension was part of the metadata.
+    metadata = await asyncio.to_thread(db.file_metadata, id)
+    if not metadata or not metadata.get("FileExtension"):
+        metadata = await sf.aget_metadata_by_id(
+            id, metadata_fields=["Title", "FileExtension"], From="ContentVersion"
+        )
+    if not metadata:
+        return responses.JSONResponse({"detail": "Not found"}, status_code=404)
+
     file_name = f"{metadata['Title']}.{metadata['FileExtension']}"
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_name)}",
+        "Accept-Ranges": "bytes",
+    }
+    cached_path = sf.cached_record_path(id)
+    if cached_path:
+        return cached_file_response(cached_path, request.headers.get("range"), headers)
+
+    forwarded = {
+        header: request.headers[header]
+        for header in ("range", "if-range")
+        if header in request.headers
+    }
+    response = await sf.astream_record(id, headers=forwarded)
+    if response.status_code not in (200, 206, 416):
+        await response.aclose()
+        return responses.JSONResponse({"detail": "Not found"}, status_code=404)
+
+    for header in ("content-length", "content-range"):
+        if header in response.headers:
+            headers[header] = response.headers[header]
+    # Chunks are forwarded as they arrive, the file is never held in memory.
     return StreamingResponse(
-        io.BytesIO(file_bytes),
+        sf.aiter_record(id, response),
+        status_code=response.status_code,
         media_type="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={file_name}"},
+        headers=headers,
+        background=BackgroundTask(response.aclose),
     )
@@ -0,0 +1,445 @@
+import io
+import os
+import csv
+import time
+import magic
+import signal
+import xlrd
+import PyPDF2
+import logging
+import openpyxl
+import resource
+import threading
+import multiprocessing
+from io import BytesIO
+from pptx import Presentation
+from docx import Document as Documentx
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+
+def file_type(file_bytes: bytes):
+    """
+    Determine the file type.
+
+    Parameters:
+        file_bytes (bytes): bytes for the file.
+    """
+
+    mime = magic.Magic(mime=True)
+    return mime.from_buffer(file_bytes)
+
+
+def _row_blocks(rows, block_size: int = 1000):
+    """
+    Group rows (lists of values) into CSV text blocks of block_size rows.
+    """
+
+    block = io.StringIO()
+    writer = csv.writer(block, lineterminator="\n")
+    count = 0
+    for row in rows:
+        writer.writerow(["" if value is None else value for value in row])
+        count += 1
+        if count == block_size:
+            yield block.getvalue()
+            block.seek(0)
+            block.truncate()
+            count = 0
+    if count:
+        yield block.getvalue()
+
+
+def _xls_rows(sheet, datemode: int):
+    for index in range(sheet.nrows):
+        row = []
+        for cell in sheet.row(index):
+            value = cell.value
+            if cell.ctype == xlrd.XL_CELL_DATE:
+                value = xlrd.xldate_as_datetime(value, datemode).isoformat(sep=" ")
+            elif cell.ctype == xlrd.XL_CELL_NUMBER and value.is_integer():
+                value = int(value)
+            row.append(value)
+        yield row
+
+
+def _decode(file_bytes: bytes):
+    try:
+        return file_bytes.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return file_bytes.decode("latin-1")
+
+
+def iter_text(file_bytes: bytes, fileType: str = None):
+    """
+    Yield the text of the file one unit at a time (page, slide, paragraph,
+    block of rows), so no parser holds the whole document as text.
+
+    Parameters:
+        file_bytes (bytes): The file in bytes.
+        fileType (str): MIME type of the file, detected when not given.
+    """
+
+    fileType = fileType if fileType else file_type(file_bytes)
+
+    # CSV files.
+    if fileType == "text/csv":
+        yield from _row_blocks(csv.reader(io.StringIO(_decode(file_bytes))))
+
+    # Excel files.
+    elif fileType == "application/vnd.ms-excel":
+        # On demand, one sheet is loaded at a time and unloaded after its rows.
+        book = xlrd.open_workbook(file_contents=file_bytes, on_demand=True)
+        try:
+            for index in range(book.nsheets):
+                sheet = book.sheet_by_index(index)
+                yield sheet.name
+                yield from _row_blocks(_xls_rows(sheet, book.datemode))
+                book.unload_sheet(index)
+        finally:
+            book.release_resources()
+
+    elif (
+        fileType == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ):
+        # Read-only mode streams the rows instead of loading the workbook.
+        workbook = openpyxl.load_workbook(
+            BytesIO(file_bytes), read_only=True, data_only=True
+        )
+        try:
+            for sheet in workbook.worksheets:
+                yield sheet.title
+                yield from _row_blocks(sheet.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+
+    # Powerpoint files.
+    elif (
+        fileType
+        == "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+    ):
+        prs = Presentation(BytesIO(file_bytes))
+        for slide in prs.slides:
+            yield "\n".join(
+                shape.text for shape in slide.shapes if hasattr(shape, "text")
+            )
+
+    # Text files.
+    elif fileType == "text/plain":
+        yield file_bytes.decode("utf-8")
+
+    # Word files.
+    elif (
+        fileType
+        == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    ):
+        doc = Documentx(BytesIO(file_bytes))
+        for paragraph in doc.paragraphs:
+            yield paragraph.text
+
+    # PDF files.
+    elif fileType == "application/pdf":
+        pdf_reader = PyPDF2.PdfReader(BytesIO(file_bytes))
+        for page in pdf_reader.pages:
+            yield page.extract_text()
+
+    # Other files
+    else:
+        print(f"unsuported filetype: {fileType}")
+
+
+def _windows(units, size: int):
+    """
+    Cut the units, joined with newlines, into windows of size characters, so
+    what is built from the windows does not depend on where the units end.
+    """
+
+    pending, length = [], 0
+    for number, unit in enumerate(units):
+        for piece in ("\n", unit) if number else (unit,):
+            start = 0
+            while start < len(piece):
+                part = piece[start : start + size - length]
+                start += len(part)
+                pending.append(part)
+                length += len(part)
+                if length == size:
+                    yield "".join(pending)
+                    pending, length = [], 0
+    if pending:
+        yield "".join(pending)
+
+
+def iter_chunks(units, chunk_size: int, chunk_overlap: int, window: int = None):
+    """
+    Split a stream of text units into chunks as they arrive. The splitter
+    only ever holds a window of text and the last chunk, which is split
+    again with the next window since it may continue there. The chunks
+    depend on the joined text only, so splitting the units of a file or its
+    whole cached text gives the same chunks.
+
+    Parameters:
+        units (iterable of str): Text units, see iter_text.
+        chunk_size (int): The size of each chunk.
+        chunk_overlap (int): The size of the overlap between adjacent chunks.
+        window (int): Characters added before each split.
+            Default value: 8 chunks.
+    """
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    buffer = ""
+    for block in _windows(units, window if window else 8 * chunk_size):
+        buffer += block
+        chunks = splitter.split_text(buffer)
+        if len(chunks) < 2:
+            continue
+        yield from chunks[:-1]
+        start = buffer.rfind(chunks[-1])
+        buffer = buffer[start:] if start >= 0 else chunks[-1]
+    if buffer:
+        yield from splitter.split_text(buffer)
+
+
+def parse(
+    file_bytes: bytes,
+    fileType: str = None,
+    chunk_size: int = None,
+    chunk_overlap: int = 0,
+    whole_text: bool = True,
+):
+    """
+    Parse the file into its whole text and its chunks in one pass over the
+    units: the splitter consumes each unit as the parser yields it. Return
+    (text, chunks), text None when whole_text is off, chunks None when
+    chunk_size is not given, and (None, None) when nothing could be read or
+    the text is only whitespace (e.g. a scanned PDF without a text layer).
+
+    Parameters:
+        file_bytes (bytes): The file in bytes.
+        fileType (str): MIME type of the file, detected when not given.
+        chunk_size (int): The size of each chunk.
+        chunk_overlap (int): The size of the overlap between adjacent chunks.
+        whole_text (bool): Build the whole text, only needed where it is stored.
+    """
+
+    text = io.StringIO() if whole_text else None
+    count = 0
+    readable = False
+
+    def units():
+        nonlocal count, readable
+        for unit in iter_text(file_bytes, fileType):
+            if text is not None:
+                text.write(f"\n{unit}" if count else unit)
+            count += 1
+            readable = readable or bool(unit.strip())
+            yield unit
+
+    chunks = None
+    if chunk_size:
+        chunks = list(iter_chunks(units(), chunk_size, chunk_overlap))
+    else:
+        for _ in units():
+            pass
+    if not readable:
+        return None, None
+    return (text.getvalue() if text is not None else None), chunks
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("extraction took too long")
+
+
+def _init_worker(memory_limit: int):
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _extract(file_bytes: bytes, timeout: float, options: dict):
+    started = time.perf_counter()
+    fileType = file_type(file_bytes)
+    parsed, error = (None, None), None
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        parsed = parse(file_bytes, fileType, **options)
+    except Exception as e:
+        error = repr(e)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return fileType, parsed, error, time.perf_counter() - started
+
+
+class Extractor:
+    def __init__(
+        self,
+        workers: int = None,
+        timeout: float = 60,
+        memory_limit_mb: int = 2048,
+    ):
+        """
+        Parse files in a pool of worker processes, one file per worker at a
+        time. Each file gets a time and memory budget; a file that goes over
+        it is skipped and the worker is replaced if it hangs. Files whose
+        worker was lost to another file are parsed again.
+
+        Parameters:
+            workers (int): Number of worker processes.
+                Default value: number of CPUs.
+            timeout (float): Seconds allowed to parse one file.
+            memory_limit_mb (int): Address space limit of a worker process in MB.
+        """
+
+        self.workers = workers if workers else os.cpu_count()
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else 0
+        self.stats = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        # Keep submissions to the pool size so the timeout never counts queueing.
+        self._slots = threading.BoundedSemaphore(self.workers)
+
+    def _new_pool(self, workers: int):
+        return ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.memory_limit,),
+        )
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_pool(self.workers)
+            return self._pool
+
+    def _stop_pool(self, pool):
+        # ProcessPoolExecutor cannot cancel a running task, so stop its workers.
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _reset_pool(self, pool):
+        # Every file in flight sees the broken pool, only the first one stops it.
+        with self._lock:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        self._stop_pool(pool)
+
+    def _run(self, pool, file_bytes: bytes, options: dict):
+        future = pool.submit(_extract, file_bytes, self.timeout, options)
+        return future.result(timeout=self.timeout + 5)
+
+    def _extract_alone(self, file_bytes: bytes, options: dict):
+        """
+        Parse the file in a worker of its own, so a crash or a hang can only
+        come from this file. Return None when it does.
+        """
+
+        pool = self._new_pool(1)
+        try:
+            return self._run(pool, file_bytes, options)
+        except (TimeoutError, BrokenProcessPool) as e:
+            logging.error(f"Extraction worker lost on its own ({e!r}).")
+            return None
+        finally:
+            self._stop_pool(pool)
+
+    def _record(self, fileType: str, elapsed: float, failed: bool):
+        with self._lock:
+            stats = self.stats.setdefault(
+                fileType, {"files": 0, "failed": 0, "seconds": 0.0, "max_seconds": 0.0}
+            )
+            stats["files"] += 1
+            stats["failed"] += int(failed)
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def parse(
+        self,
+        file_bytes: bytes,
+        chunk_size: int = None,
+        chunk_overlap: int = 0,
+        whole_text: bool = True,
+    ):
+        """
+        Parse the file in a worker process and return its text and chunks,
+        see parse, or (None, None) when the type is not supported or the
+        file could not be parsed in budget. The chunks are split in the
+        worker while the file is parsed.
+
+        Parameters:
+            file_bytes (bytes): The file in bytes.
+            chunk_size (int): The size of each chunk, None to not split.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            whole_text (bool): Build the whole text.
+        """
+
+        options = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "whole_text": whole_text,
+        }
+        with self._slots:
+            pool = self._get_pool()
+            started = time.perf_counter()
+            try:
+                result = self._run(pool, file_bytes, options)
+            except TimeoutError:
+                logging.error("Extraction worker hung, restarting the pool.")
+                self._reset_pool(pool)
+                result = None
+            except (BrokenProcessPool, CancelledError, RuntimeError) as e:
+                # Any file in flight may have broken the pool, so run this one
+                # again alone to tell whether it is the culprit.
+                logging.warning(f"Extraction pool lost ({e!r}), retrying the file.")
+                self._reset_pool(pool)
+                result = self._extract_alone(file_bytes, options)
+            if result is None:
+                self._record("unknown", time.perf_counter() - started, True)
+                return None, None
+
+        fileType, parsed, error, elapsed = result
+        self._record(fileType, elapsed, error is not None)
+        if error:
+            logging.error(f"Failed to extract {fileType} file: {error}")
+        return parsed
+
+    def extract(self, file_bytes: bytes):
+        """
+        Parse the file in a worker process and return its text, or None when
+        the type is not supported or the file could not be parsed in budget.
+
+        Parameters:
+            file_bytes (bytes): The file in bytes.
+        """
+
+        return self.parse(file_bytes)[0]
+
+    def report(self):
+        """
+        Log the parse latency per MIME type.
+        """
+
+        with self._lock:
+            stats = {key: dict(value) for key, value in self.stats.items()}
+        for fileType, value in sorted(stats.items()):
+            logging.info(
+                f"{fileType}: {value['files']} files ({value['failed']} failed), "
+                f"mean {value['seconds'] / value['files']:.3f}s, "
+                f"max {value['max_seconds']:.3f}s"
+            )
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
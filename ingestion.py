@@ -0,0 +1,258 @@
+import time
+import queue
+import logging
+import threading
+from cache import TextCache
+from itertools import islice
+from schema import Document
+from extraction import Extractor
+from salesforce import Salesforce
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class IngestionStats:
+    def __init__(self, total: int = None):
+        """
+        Parameters:
+            total (int): Number of records to ingest, if known.
+        """
+
+        self.total = total
+        self.done = 0
+        self.ingested = 0
+        self.cached = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def report(self):
+        """
+        Log the progress and throughput of the ingestion so far.
+        """
+
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        total = self.total if self.total is not None else "?"
+        logging.info(
+            f"ingested {self.done}/{total} records "
+            f"({self.ingested} ok, {self.cached} from cache, "
+            f"{self.skipped} skipped, {self.failed} failed) "
+            f"in {elapsed:.1f}s: {self.done / elapsed:.2f} records/s, "
+            f"{self.bytes / elapsed / 1e6:.2f} MB/s"
+        )
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        sf: Salesforce,
+        download_workers: int = 8,
+        extractor: Extractor = None,
+        text_cache: TextCache = None,
+        report_every: int = 50,
+    ):
+        """
+        Download records with a pool of threads and parse them with the
+        extractor's pool of processes, keeping at most two downloads per
+        thread in flight.
+
+        Parameters:
+            sf: Salesforce object to connect with salesforce.
+            download_workers (int): Number of threads downloading records.
+            extractor (Extractor): Engine parsing the downloaded files.
+                Default value: an Extractor with one process per CPU.
+            text_cache (TextCache): Cache of extracted text; records found in
+                it are neither downloaded nor parsed again.
+            report_every (int): Log progress every n records.
+        """
+
+        self.sf = sf
+        self.download_workers = download_workers
+        self.extractor = extractor if extractor else Extractor()
+        self.text_cache = text_cache
+        self.report_every = report_every
+        self.stats = None
+
+    def _process_record(self, record: dict, split: dict):
+        # A ContentVersion never changes under the same Id, the checksum (when
+        # requested) guards against anything else.
+        version = str(record.get("Checksum") or "")
+        if self.text_cache:
+            record_text = self.text_cache.get(record["Id"], version)
+            if record_text is not None:
+                return Document(page_content=record_text, metadata=record), None
+
+        record_bytes = self.sf.get_record_by_id(record["Id"])
+        if record_bytes is None:
+            # Counted as failed, so the sync watermark stays and it is retried.
+            raise RuntimeError(f"Failed to download record {record['Id']}.")
+        if not record_bytes:
+            return None, 0
+        # The whole text is only built where it is stored.
+        record_text, chunks = self.extractor.parse(
+            record_bytes,
+            chunk_size=split["chunk_size"],
+            chunk_overlap=split["chunk_overlap"],
+            whole_text=split["whole_text"] or self.text_cache is not None,
+        )
+        if not record_text and not chunks:
+            return None, len(record_bytes)
+        if self.text_cache and record_text:
+            self.text_cache.put(record["Id"], record_text, version)
+        doc = Document(page_content=record_text or "", metadata=record, chunks=chunks)
+        return doc, len(record_bytes)
+
+    def run(
+        self,
+        records,
+        stats: IngestionStats = None,
+        chunk_size: int = None,
+        chunk_overlap: int = 0,
+        whole_text: bool = True,
+    ):
+        """
+        Download and parse the records concurrently and yield a Document for
+        every record as soon as it is ready. A record that fails is logged and
+        skipped without stopping the others.
+
+        Parameters:
+            records (iterable of dict): Records metadata, as returned by
+                Salesforce.iter_records. Each one must hold the record Id.
+            stats (IngestionStats): Counters of this run, so concurrent runs
+                keep their own. Default value: new counters in self.stats.
+            chunk_size (int): Split the text into chunks of this size while
+                parsing, None to not split.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            whole_text (bool): Keep the whole text of the records in the
+                Documents; it is built anyway for the text cache.
+        """
+
+        if stats is None:
+            stats = IngestionStats()
+        if stats.total is None and hasattr(records, "__len__"):
+            stats.total = len(records)
+        self.stats = stats
+        split = {
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "whole_text": whole_text,
+        }
+        records = iter(records)
+        window = 2 * self.download_workers
+
+        with ThreadPoolExecutor(self.download_workers) as io_pool:
+            pending = {}
+
+            def submit(records):
+                for record in records:
+                    future = io_pool.submit(self._process_record, record, split)
+                    pending[future] = record["Id"]
+
+            submit(islice(records, window))
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc = self._collect(future, pending.pop(future), stats)
+                    if stats.done % self.report_every == 0:
+                        stats.report()
+                    if doc is not None:
+                        yield doc
+                submit(islice(records, len(done)))
+
+        stats.report()
+        self.extractor.report()
+
+    def _collect(self, future, id: str, stats: IngestionStats):
+        stats.done += 1
+        try:
+            doc, size = future.result()
+        except Exception:
+            stats.failed += 1
+            logging.exception(f"Failed to ingest record {id}.")
+            return None
+        if size is None:
+            stats.cached += 1
+            return doc
+        stats.bytes += size
+        if doc is None:
+            stats.skipped += 1
+        else:
+            stats.ingested += 1
+        return doc
+
+
+class BatchWriter:
+    def __init__(self, write, batch_size: int = 50, max_pending: int = 2, key=None):
+        """
+        Group items into batches and write them on a background thread while
+        the producer keeps going. At most max_pending full batches wait in the
+        queue; beyond that put blocks, so memory stays bounded. A batch that
+        fails is logged and dropped without stopping the others.
+
+        Parameters:
+            write: Callable writing a list of items. A number it returns, e.g.
+                of the entries actually changed, is added up in changed.
+            batch_size (int): Number of items per batch.
+            max_pending (int): Number of full batches allowed to wait.
+            key: Callable returning the ID of an item, to collect the IDs of
+                the items written successfully in written_ids.
+        """
+
+        self.write = write
+        self.batch_size = batch_size
+        self.key = key
+        self.written = 0
+        self.changed = 0
+        self.failed = 0
+        self.written_ids = []
+        self._batch = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            try:
+                changed = self.write(batch)
+            except Exception:
+                self.failed += len(batch)
+                logging.exception(f"Failed to write a batch of {len(batch)} items.")
+                continue
+            self.written += len(batch)
+            if isinstance(changed, int):
+                self.changed += changed
+            if self.key:
+                self.written_ids.extend(self.key(item) for item in batch)
+
+    def put(self, item):
+        """
+        Add an item, handing the batch to the writer thread once it is full.
+
+        Parameters:
+            item: Item to write.
+        """
+
+        self._batch.append(item)
+        if len(self._batch) >= self.batch_size:
+            self._queue.put(self._batch)
+            self._batch = []
+
+    def close(self):
+        """
+        Write the last partial batch and wait for the writer thread.
+        """
+
+        if self._batch:
+            self._queue.put(self._batch)
+            self._batch = []
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,7 +1,12 @@
+import time
+import httpx
+import asyncio
 import logging
 import requests
+import threading
 from typing import List
-from llama_hub.tools.salesforce import SalesforceToolSpec
+from cache import BlobCache, LRUCache
+from requests.adapters import HTTPAdapter
 
 
 class Salesforce:
@@ -14,6 +19,13 @@ class Salesforce:
         consumer_secret: str,
         domain: str,
         url: str = None,
+        pool_maxsize: int = 10,
+        token_ttl: int = 3600,
+        api_version: str = "59.0",
+        links_cache_size: int = 4096,
+        links_cache_ttl: float = 300,
+        blob_cache_path: str = "cache/blobs",
+        blob_cache_max_size_mb: int = 2048,
     ):
         """
         Parameters:
@@ -24,6 +36,15 @@ class Salesforce:
             domain (str): Salesforce domain (domain.salesforce.com).
             url (str): Salesforce url to download files.
                 Default value: https://pwc-me--sundev.sandbox.file.force.com/sfc/servlet.shepherd/version/download/
+            pool_maxsize (int): Number of keep-alive connections kept per host.
+            token_ttl (int): Seconds before the cached access token is refreshed.
+            api_version (str): Salesforce REST API version used for SOQL.
+            links_cache_size (int): Number of assets whose attached files are cached.
+            links_cache_ttl (float): Seconds the attached files of an asset stay cached.
+            blob_cache_path (str): Directory of the downloaded files cache, None to
+                disable it.
+            blob_cache_max_size_mb (int): Maximum size of the downloaded files
+                cache in MB.
         """
 
         self.__username = username
@@ -36,84 +57,341 @@ class Salesforce:
             if url
             else "https://pwc-me--sundev.sandbox.file.force.com/sfc/servlet.shepherd/version/download/"
         )
-        self.sf = SalesforceToolSpec(
-            username=self.__username,
-            password=self.__password,
-            consumer_key=self.__consumer_key,
-            consumer_secret=self.__consumer_secret,
-            domain=self.__domain,
-        )
+        self._api_version = api_version
+        self._token_ttl = token_ttl
+        self.__access_token = None
+        self.__instance_url = None
+        self.__token_expiry = 0.0
+        self.__token_lock = threading.Lock()
+
+        # One keep-alive pool shared by downloads and SOQL calls.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Async twin of the session for the asyncio request path, created on
+        # first use inside the event loop.
+        self._pool_maxsize = pool_maxsize
+        self._async_client = None
         self.Records_ids = []
+        self.attachments = LRUCache(max_size=links_cache_size, ttl=links_cache_ttl)
+        self.blobs = (
+            BlobCache(blob_cache_path, max_size_mb=blob_cache_max_size_mb)
+            if blob_cache_path
+            else None
+        )
 
-    def generate_access_token(self):
-        payload = {
-            "grant_type": "password",
-            "client_id": self.__consumer_key,
-            "client_secret": self.__consumer_secret,
-            "username": self.__username,
-            "password": self.__password,
-        }
-        access_token_url = "https://test.salesforce.com/services/oauth2/token"
-        response = requests.post(access_token_url, data=payload)
-        return response.json()["access_token"]
+    def generate_access_token(self, force_refresh: bool = False):
+        """
+        Return the cached access token, requesting a new one only when it has
+        expired or when force_refresh is set (e.g. after a 401).
 
-    def get_records_ids(
+        Parameters:
+            force_refresh (bool): Ignore the cached token and log in again.
+        """
+
+        with self.__token_lock:
+            if (
+                self.__access_token
+                and not force_refresh
+                and time.monotonic() < self.__token_expiry
+            ):
+                return self.__access_token
+
+            payload = {
+                "grant_type": "password",
+                "client_id": self.__consumer_key,
+                "client_secret": self.__consumer_secret,
+                "username": self.__username,
+                "password": self.__password,
+            }
+            domain = self.__domain if self.__domain else "test"
+            access_token_url = f"https://{domain}.salesforce.com/services/oauth2/token"
+            response = self.session.post(access_token_url, data=payload)
+            response.raise_for_status()
+            token = response.json()
+            self.__access_token = token["access_token"]
+            self.__instance_url = token["instance_url"]
+            self.__token_expiry = time.monotonic() + self._token_ttl
+            return self.__access_token
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        Send an authorized request through the shared session, refreshing the
+        token and retrying once if Salesforce answers with 401.
+
+        Parameters:
+            method (str): HTTP method.
+            url (str): Full url or path relative to the instance url.
+            kwargs: Extra arguments passed to requests.
+        """
+
+        headers = kwargs.pop("headers", {})
+        token = self.generate_access_token()
+        if url.startswith("/"):
+            url = f"{self.__instance_url}{url}"
+        headers["Authorization"] = f"Bearer {token}"
+        response = self.session.request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            response.close()
+            headers["Authorization"] = f"Bearer {self.generate_access_token(True)}"
+            response = self.session.request(method, url, headers=headers, **kwargs)
+        return response
+
+    async def arequest(self, method: str, url: str, stream: bool = False, **kwargs):
+        """
+        Async version of request, sent through an httpx.AsyncClient. Token
+        refreshes run in a worker thread so they never block the event loop.
+
+        Parameters:
+            method (str): HTTP method.
+            url (str): Full url or path relative to the instance url.
+            stream (bool): Return once the headers arrived, without reading
+                the body; the caller must close the response.
+            kwargs: Extra arguments passed to httpx.
+        """
+
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self._pool_maxsize),
+                timeout=httpx.Timeout(60.0),
+            )
+        headers = kwargs.pop("headers", {})
+        token = await asyncio.to_thread(self.generate_access_token)
+        if url.startswith("/"):
+            url = f"{self.__instance_url}{url}"
+        headers["Authorization"] = f"Bearer {token}"
+        request = self._async_client.build_request(
+            method, url, headers=headers, **kwargs
+        )
+        response = await self._async_client.send(request, stream=stream)
+        if response.status_code == 401:
+            await response.aclose()
+            token = await asyncio.to_thread(self.generate_access_token, True)
+            headers["Authorization"] = f"Bearer {token}"
+            request = self._async_client.build_request(
+                method, url, headers=headers, **kwargs
+            )
+            response = await self._async_client.send(request, stream=stream)
+        return response
+
+    async def aclose(self):
+        """
+        Close the async HTTP client.
+        """
+
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def aexecute_soql(self, query: str):
+        """
+        Async version of execute_soql.
+
+        Parameters:
+            query (str): SOQL query.
+        """
+
+        url = f"/services/data/v{self._api_version}/query/"
+        params = {"q": query}
+        result = None
+        while url:
+            response = await self.arequest("GET", url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            if result is None:
+                result = page
+            else:
+                result["records"].extend(page["records"])
+            url = None if page["done"] else page["nextRecordsUrl"]
+            params = None
+        result["done"] = True
+        return result
+
+    def query_pages(self, query: str):
+        """
+        Run a SOQL query through the REST API and yield its result pages one
+        at a time. The next page (nextRecordsUrl) is only requested once the
+        previous one has been consumed.
+
+        Parameters:
+            query (str): SOQL query.
+        """
+
+        url = f"/services/data/v{self._api_version}/query/"
+        params = {"q": query}
+        while url:
+            response = self.request("GET", url, params=params)
+            response.raise_for_status()
+            page = response.json()
+            yield page
+            url = None if page["done"] else page["nextRecordsUrl"]
+            params = None
+
+    def execute_soql(self, query: str):
+        """
+        Run a SOQL query through the REST API, following nextRecordsUrl so
+        every matching record is returned.
+
+        Parameters:
+            query (str): SOQL query.
+        """
+
+        pages = self.query_pages(query)
+        result = next(pages)
+        for page in pages:
+            result["records"].extend(page["records"])
+        result["done"] = True
+        return result
+
+    def iter_records(
         self,
+        metadata_fields: List[str] = ["Id"],
         From: str = None,
         Where: str = None,
         OrderBy: str = None,
         Limit: str = None,
     ):
         """
-        Get all the records IDs using SOQL.
+        Stream the matching records with their metadata fields as the SOQL
+        pages arrive, so only one page is held in memory at a time. The Id
+        field is always included.
 
         Parameters:
+            metadata_fields (list of strings): salesforce fields names.
             From (str): Salesforce object name.
             Where (str): Where clause.
             OrderBy (str): Order by clause.
             Limit (str): Limit clause.
         """
 
-        self.Records_ids = []
+        if "Id" not in metadata_fields:
+            metadata_fields = ["Id", *metadata_fields]
 
-        Select = "SELECT Id "
+        Select = f"SELECT {', '.join(metadata_fields)} "
         From = f"FROM {From} " if From else ""
         Where = f"WHERE {Where} " if Where else ""
         OrderBy = f"ORDER BY {OrderBy} " if OrderBy else ""
         Limit = f"LIMIT {Limit}" if Limit else ""
 
+        for page in self.query_pages(f"{Select}{From}{Where}{OrderBy}{Limit}"):
+            for record in page["records"]:
+                yield {field: record[field] for field in metadata_fields}
+
+    def get_records_ids(
+        self,
+        From: str = None,
+        Where: str = None,
+        OrderBy: str = None,
+        Limit: str = None,
+    ):
+        """
+        Get all the records IDs using SOQL.
+
+        Parameters:
+            From (str): Salesforce object name.
+            Where (str): Where clause.
+            OrderBy (str): Order by clause.
+            Limit (str): Limit clause.
+        """
+
         try:
-            records = self.sf.execute_soql(f"{Select}{From}{Where}{OrderBy}{Limit}")
-            for i in range(records["totalSize"]):
-                self.Records_ids.append(records["records"][i]["Id"])
+            self.Records_ids = [
+                record["Id"]
+                for record in self.iter_records(
+                    From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+                )
+            ]
             return self.Records_ids
 
         except Exception as e:
             logging.exception(e)
 
+    def get_document_links(
+        self, ids, By: str = "LinkedEntityId", batch_size: int = 200
+    ):
+        """
+        Get the ContentDocumentLinks of many records with batched
+        `WHERE <By> IN (...)` queries, as (ContentDocumentId, LinkedEntityId)
+        pairs.
+
+        Parameters:
+            ids (iterable of str): Salesforce records IDs.
+            By (str): Field the IDs are matched on, 'LinkedEntityId' or
+                'ContentDocumentId'.
+            batch_size (int): Number of IDs per query.
+        """
+
+        ids = list(ids)
+        links = []
+        for start in range(0, len(ids), batch_size):
+            batch = ", ".join(f"'{id}'" for id in ids[start : start + batch_size])
+            for record in self.iter_records(
+                ["ContentDocumentId", "LinkedEntityId"],
+                From="ContentDocumentLink",
+                Where=f"{By} IN ({batch})",
+            ):
+                links.append((record["ContentDocumentId"], record["LinkedEntityId"]))
+        return links
+
+    def get_deleted_ids(self, From: str, start: str, end: str):
+        """
+        Get the IDs of the records deleted between start and end with the
+        getDeleted REST resource. Salesforce keeps them for about 30 days.
+
+        Parameters:
+            From (str): Salesforce object name.
+            start (str): ISO 8601 start of the window.
+            end (str): ISO 8601 end of the window.
+        """
+
+        response = self.request(
+            "GET",
+            f"/services/data/v{self._api_version}/sobjects/{From}/deleted/",
+            params={"start": start, "end": end},
+        )
+        response.raise_for_status()
+        return [record["id"] for record in response.json()["deletedRecords"]]
+
     def get_record_by_id(self, id: str):
         """
-        Use get request to download the file using the file ID.
+        Use get request to download the file using the file ID, reading
+        through the blob cache.
 
         Parameters:
             id (str): Salesforce record ID.
         """
 
+        if self.blobs:
+            file_bytes = self.blobs.get(id)
+            if file_bytes is not None:
+                return file_bytes
+
         full_url = f"{self._url}{id}"
-        headers = {
-            "Authorization": "Bearer " + self.generate_access_token(),
-            "Content-Type": "application/json",
-        }
+        headers = {"Content-Type": "application/json"}
         try:
-            response = requests.get(full_url, headers=headers)
+            response = self.request("GET", full_url, headers=headers)
         except Exception as e:
             logging.exception(e)
+            return None
 
         if response.status_code == 200:
+            if self.blobs:
+                self.blobs.put(id, response.content)
             return response.content
 
         return None
 
+    def cached_record_path(self, id: str):
+        """
+        Return the path of the file in the blob cache, or None.
+
+        Parameters:
+            id (str): Salesforce record ID.
+        """
+
+        return self.blobs.get_path(id) if self.blobs else None
+
     def get_metadata_by_id(
         self, id, metadata_fields: List[str] = None, From: str = None
     ):
@@ -131,7 +409,7 @@ class Salesforce:
         From = f"FROM {From} " if From else ""
         Where = f"WHERE Id= '{id}'"
         try:
-            record = self.sf.execute_soql(f"{Select}{From}{Where}")
+            record = self.execute_soql(f"{Select}{From}{Where}")
             record = record["records"][0]
             extracted_data = {}
 
@@ -143,6 +421,70 @@ class Salesforce:
         except Exception as e:
             logging.exception(e)
 
+    async def astream_record(self, id: str, headers: dict = None):
+        """
+        Start downloading the file and return the open response, whose body
+        is read chunk by chunk with aiter_record. Range headers are forwarded,
+        so Salesforce can answer with partial content.
+
+        Parameters:
+            id (str): Salesforce record ID.
+            headers (dict): Extra request headers, e.g. Range.
+        """
+
+        # Identity encoding so the raw chunks are the file itself.
+        headers = {**(headers or {}), "Accept-Encoding": "identity"}
+        return await self.arequest(
+            "GET", f"{self._url}{id}", stream=True, headers=headers
+        )
+
+    async def aiter_record(self, id: str, response):
+        """
+        Yield the body of a streamed download chunk by chunk, copying a
+        complete (200) body into the blob cache on the way.
+
+        Parameters:
+            id (str): Salesforce record ID.
+            response: Response returned by astream_record.
+        """
+
+        writer = None
+        if self.blobs and response.status_code == 200:
+            writer = self.blobs.writer(id)
+        try:
+            async for chunk in response.aiter_raw():
+                if writer:
+                    writer.write(chunk)
+                yield chunk
+        except BaseException:
+            if writer:
+                writer.discard()
+            raise
+        if writer:
+            writer.commit()
+
+    async def aget_metadata_by_id(
+        self, id, metadata_fields: List[str] = None, From: str = None
+    ):
+        """
+        Async version of get_metadata_by_id.
+
+        Parameters:
+            id (str): Salesforce record ID.
+            metadata_fields (list of strings): salesforce fields names.
+            From (str): Salesforce object name.
+        """
+
+        Select = f"SELECT {', '.join(metadata_fields)} "
+        From = f"FROM {From} " if From else ""
+        Where = f"WHERE Id= '{id}'"
+        try:
+            record = await self.aexecute_soql(f"{Select}{From}{Where}")
+            record = record["records"][0]
+            return {field: record[field] for field in metadata_fields}
+        except Exception as e:
+            logging.exception(e)
+
     def get_content_documents_link(
         self, knowledge_id: str, Select: str = None, From: str = None, Where: str = None
     ):
@@ -150,7 +492,7 @@ class Salesforce:
         FROM = f"FROM {From} " if From else ""
         WHERE = f"WHERE {Where}='{knowledge_id}'" if Where else ""
         try:
-            links = self.sf.execute_soql(f"{SELECT}{FROM}{WHERE}")
+            links = self.execute_soql(f"{SELECT}{FROM}{WHERE}")
             return links["records"]
         except Exception as e:
             logging.exception(e)
@@ -171,7 +513,7 @@ class Salesforce:
         )
         print(link[-1]["LinkedEntityId"])
         try:
-            asset = self.sf.execute_soql(
+            asset = self.execute_soql(
                 f"SELECT Id, Title, CreatedDate, Description__c, URL__c FROM Knowledge__Kav WHERE Id='{link[-1]['LinkedEntityId']}'"
             )
             print(asset["records"][-1]["Title"])
@@ -180,24 +522,36 @@ class Salesforce:
             print(e)
 
     def get_related_files_ids(self, content_document_id: str):
-        response = self.sf.execute_soql(
+        response = self.execute_soql(
             f"SELECT Id FROM FROM ContentVersion WHERE ContentDocumentId='{content_document_id}'"
         )
 
     def get_attachments_in_assets(self, assets_dict):
+        """
+        Get the ContentDocument IDs attached to each asset, ["0"] for an asset
+        without attachments. Assets missing from the cache are resolved
+        together with batched `LinkedEntityId IN (...)` queries.
+
+        Parameters:
+            assets_dict (List[Dict]): Assets, each with its Id.
+        """
+
         attachment_ids_dict = {}
         try:
+            missing = []
             for asset in assets_dict:
-                files_ids = self.sf.execute_soql(
-                    f"SELECT ContentDocumentId FROM ContentDocumentLink WHERE LinkedEntityId='{asset['Id']}'"
-                )
-                if files_ids["totalSize"] > 0:
-                    attachment_ids_dict[asset["Id"]] = [
-                        record["ContentDocumentId"] for record in files_ids["records"]
-                    ]
+                attachment_ids = self.attachments.get(asset["Id"])
+                if attachment_ids is None:
+                    missing.append(asset["Id"])
                 else:
-                    attachment_ids_dict[asset["Id"]] = ["0"]
+                    attachment_ids_dict[asset["Id"]] = attachment_ids
+            found = {id: [] for id in missing}
+            for content_document_id, asset_id in self.get_document_links(missing):
+                found[asset_id].append(content_document_id)
+            for asset_id, attachment_ids in found.items():
+                attachment_ids = attachment_ids if attachment_ids else ["0"]
+                self.attachments.put(asset_id, attachment_ids)
+                attachment_ids_dict[asset_id] = attachment_ids
         except Exception as e:
             logging.exception(e)
-        print(attachment_ids_dict)
         return attachment_ids_dict
@@ -1,11 +1,14 @@
 class Document:
-    def __init__(self, page_content:str, metadata:dict):
+    def __init__(self, page_content:str, metadata:dict, chunks:list = None):
         
         """
         Parameters:
             page_content (str): Text.
             metadata (dict): Metadata for the text.
+            chunks (List[str]): Text split into chunks while it was parsed, None
+                when it was not split.
         """
 
         self.page_content = page_content
-        self.metadata = metadata
\ No newline at end of file
+        self.metadata = metadata
+        self.chunks = chunks
\ No newline at end of file
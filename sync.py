@@ -0,0 +1,247 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+
+
+def soql_datetime(value: str):
+    """
+    Convert a Salesforce timestamp (e.g. 2024-02-10T12:34:56.000+0000) to a
+    UTC SOQL datetime literal.
+
+    Parameters:
+        value (str): Salesforce timestamp.
+    """
+
+    timestamp = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+    return timestamp.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def epoch_seconds(value: str):
+    """
+    Convert a Salesforce timestamp to seconds since the epoch, the numeric
+    form stored in metadata so date ranges can be filtered in the index.
+
+    Parameters:
+        value (str): Salesforce timestamp.
+    """
+
+    return int(datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z").timestamp())
+
+
+class RecordStream:
+    def __init__(
+        self,
+        sf,
+        metadata,
+        From: str = "",
+        Where: str = "",
+        OrderBy: str = "",
+        Limit: str = "",
+    ):
+        """
+        Records of one ingest or sync run streamed from Salesforce, collecting
+        their IDs and the latest SystemModstamp, the sync watermark, along the
+        way. CreatedDate is also stored as epoch seconds in CreatedTimestamp
+        for range filters. Every run iterates its own stream, so runs going on
+        at the same time never mix their IDs or watermarks.
+
+        Parameters:
+            sf: Salesforce object to connect with salesforce.
+            metadata (List[str]): List of metadata fields to retrieve.
+            From (str): Salesforce object name.
+            Where (str): Where clause.
+            OrderBy (str): Order by clause.
+            Limit (str): Limit clause.
+        """
+
+        self.sf = sf
+        self.metadata = metadata
+        self.From = From
+        self.Where = Where
+        self.OrderBy = OrderBy
+        self.Limit = Limit
+        self.ids = []
+        self.last_modstamp = None
+        self.failed = False
+
+    def __iter__(self):
+        fields = self.metadata
+        if "SystemModstamp" not in self.metadata:
+            fields = [*self.metadata, "SystemModstamp"]
+        try:
+            for record in self.sf.iter_records(
+                fields,
+                From=self.From,
+                Where=self.Where,
+                OrderBy=self.OrderBy,
+                Limit=self.Limit,
+            ):
+                modstamp = record["SystemModstamp"]
+                if record.get("CreatedDate"):
+                    record["CreatedTimestamp"] = epoch_seconds(record["CreatedDate"])
+                if "SystemModstamp" not in self.metadata:
+                    del record["SystemModstamp"]
+                if self.last_modstamp is None or modstamp > self.last_modstamp:
+                    self.last_modstamp = modstamp
+                self.ids.append(record["Id"])
+                yield record
+        except Exception as e:
+            self.failed = True
+            logging.exception(e)
+
+    @property
+    def watermark(self):
+        """
+        SOQL datetime of the latest SystemModstamp, None when no record came
+        or the stream broke off.
+        """
+
+        if self.failed or self.last_modstamp is None:
+            return None
+        return soql_datetime(self.last_modstamp)
+
+
+class SyncState:
+    def __init__(self, path: str = "cache/sync_state.json"):
+        """
+        Persisted watermark and known record IDs of every synced source, so
+        incremental syncs survive restarts, and the one-off migrations of the
+        store already done.
+
+        Parameters:
+            path (str): Path of the JSON file holding the state.
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state = json.load(f)
+
+    def get(self, key: str):
+        """
+        Return the state of a source: its watermark and known IDs.
+
+        Parameters:
+            key (str): Name of the synced source.
+        """
+
+        with self._lock:
+            state = self._state.get(key, {})
+            return {
+                "watermark": state.get("watermark"),
+                "ids": set(state.get("ids", [])),
+            }
+
+    def set(self, key: str, watermark: str = None, ids=None):
+        """
+        Save the state of a source, writing the file atomically.
+
+        Parameters:
+            key (str): Name of the synced source.
+            watermark (str): Latest SystemModstamp seen.
+            ids (iterable of str): IDs of the records in the vector store.
+        """
+
+        with self._lock:
+            self._state[key] = {
+                "watermark": watermark,
+                "ids": sorted(ids) if ids is not None else [],
+            }
+            self._save()
+
+    def migrated(self, name: str):
+        """
+        Return whether a one-off migration of the store is done.
+
+        Parameters:
+            name (str): Name of the migration.
+        """
+
+        with self._lock:
+            return name in self._state.get("migrations", [])
+
+    def set_migrated(self, name: str):
+        """
+        Record that a one-off migration of the store is done.
+
+        Parameters:
+            name (str): Name of the migration.
+        """
+
+        with self._lock:
+            migrations = self._state.setdefault("migrations", [])
+            if name not in migrations:
+                migrations.append(name)
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.path)
+
+
+class SyncScheduler:
+    def __init__(self, job, interval: float = 300):
+        """
+        Run a sync job every interval seconds in a background thread. Runs
+        never overlap, also with runs triggered through run_now.
+
+        Parameters:
+            job: Callable doing one sync.
+            interval (float): Seconds between two syncs.
+        """
+
+        self.job = job
+        self.interval = interval
+        self.last_run = None
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_now(self, job=None):
+        """
+        Run the job in the calling thread, waiting for a running sync first.
+
+        Parameters:
+            job: Callable run instead of the scheduled job, e.g. a partial sync.
+        """
+
+        with self._run_lock:
+            try:
+                return (job if job else self.job)()
+            except Exception:
+                logging.exception("Sync failed.")
+            finally:
+                self.last_run = datetime.now(timezone.utc).isoformat()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.run_now()
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
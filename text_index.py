@@ -0,0 +1,300 @@
+import os
+import re
+import json
+import sqlite3
+import threading
+
+
+def to_match_expression(query: str, match_any: bool = False):
+    """
+    Translate a search query into an FTS5 MATCH expression. Text in double
+    quotes is a phrase and a word ending with * is a prefix; all the parts
+    must match. A query with neither is searched as one phrase, like the
+    previous substring search.
+
+    Parameters:
+        query (str): Search query.
+        match_any (bool): Match documents holding any of the words instead,
+            for BM25 ranking of loosely phrased queries.
+    """
+
+    def quote(text: str):
+        return '"' + text.replace('"', '""') + '"'
+
+    if match_any:
+        words = re.findall(r"\w+", query)
+        return " OR ".join(quote(word) for word in words)
+
+    if '"' not in query and "*" not in query:
+        return quote(query.strip())
+
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+        if phrase.strip():
+            parts.append(quote(phrase.strip()))
+        elif word:
+            word = word.replace('"', "")
+            if word.endswith("*") and word.strip("*"):
+                parts.append(quote(word.strip("*")) + "*")
+            elif word.strip("*"):
+                parts.append(quote(word.strip("*")))
+    return " ".join(parts)
+
+
+COMPARISONS = {"$eq": "=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def where_to_sql(where: dict):
+    """
+    Translate a Chroma metadata filter ($in, $eq, $gt, $gte, $lt, $lte, $or,
+    $and) into an SQL condition on the JSON metadata column, with its
+    parameters.
+
+    Parameters:
+        where (dict): Chroma where filter.
+    """
+
+    conditions, params = [], []
+    for key, value in where.items():
+        if key in ("$or", "$and"):
+            parts = [where_to_sql(part) for part in value]
+            joiner = " OR " if key == "$or" else " AND "
+            conditions.append("(" + joiner.join(part[0] for part in parts) + ")")
+            for part in parts:
+                params.extend(part[1])
+            continue
+        field = "json_extract(metadata, ?)"
+        path = f"$.{key}"
+        if not isinstance(value, dict):
+            value = {"$eq": value}
+        for operator, operand in value.items():
+            if operator == "$in":
+                placeholders = ", ".join("?" for _ in operand)
+                conditions.append(f"{field} IN ({placeholders})")
+                params.extend([path, *operand])
+            else:
+                conditions.append(f"{field} {COMPARISONS[operator]} ?")
+                params.extend([path, operand])
+    return " AND ".join(conditions), params
+
+
+class TextIndex:
+    def __init__(self, path: str = "chromaDB/text_index.sqlite3"):
+        """
+        Inverted full-text index (SQLite FTS5) of whole documents, ranked
+        with BM25. Each table holds one kind of document (files, assets).
+
+        Parameters:
+            path (str): Path of the SQLite file holding the index.
+        """
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._tables = set()
+
+    def _table(self, name: str):
+        if name not in self._tables:
+            self._db.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+                "id UNINDEXED, content, metadata UNINDEXED, "
+                "tokenize='unicode61 remove_diacritics 2')"
+            )
+            # FTS5 columns have no index, documents are found by rowid through
+            # this table, by their ID or by the Id of their record.
+            exists = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = ?", (f"{name}_rows",)
+            ).fetchone()
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {name}_rows ("
+                "id TEXT PRIMARY KEY, row INTEGER, record TEXT)"
+            )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {name}_rows_record "
+                f"ON {name}_rows (record)"
+            )
+            if not exists:
+                # Index created before the rows table existed.
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {name}_rows "
+                    f"SELECT id, rowid, json_extract(metadata, '$.Id') FROM {name}"
+                )
+            self._db.commit()
+            self._tables.add(name)
+        return name
+
+    def _rows(self, table: str, column: str, values):
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), 500):
+            batch = values[start : start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            rows += self._db.execute(
+                f"SELECT id, row FROM {table}_rows WHERE {column} IN ({placeholders})",
+                batch,
+            ).fetchall()
+        return dict(rows)
+
+    def _delete_rows(self, table: str, rows: dict):
+        self._db.executemany(
+            f"DELETE FROM {table} WHERE rowid = ?", [(row,) for row in rows.values()]
+        )
+        self._db.executemany(
+            f"DELETE FROM {table}_rows WHERE id = ?", [(id,) for id in rows]
+        )
+
+    def count(self, name: str):
+        """
+        Return the number of documents in the table.
+
+        Parameters:
+            name (str): Table name.
+        """
+
+        with self._lock:
+            table = self._table(name)
+            return self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def upsert(self, name: str, ids, documents, metadatas):
+        """
+        Add or replace documents.
+
+        Parameters:
+            name (str): Table name.
+            ids (List[str]): Documents IDs.
+            documents (List[str]): Documents text.
+            metadatas (List[dict]): Documents metadata.
+        """
+
+        with self._lock:
+            table = self._table(name)
+            self._delete_rows(table, self._rows(table, "id", ids))
+            for id, document, metadata in zip(ids, documents, metadatas):
+                cursor = self._db.execute(
+                    f"INSERT INTO {table} (id, content, metadata) VALUES (?, ?, ?)",
+                    (id, document, json.dumps(metadata)),
+                )
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {table}_rows VALUES (?, ?, ?)",
+                    (id, cursor.lastrowid, metadata.get("Id")),
+                )
+            self._db.commit()
+
+    def delete(self, name: str, ids):
+        """
+        Delete documents.
+
+        Parameters:
+            name (str): Table name.
+            ids (List[str]): Documents IDs.
+        """
+
+        with self._lock:
+            table = self._table(name)
+            self._delete_rows(table, self._rows(table, "id", ids))
+            self._db.commit()
+
+    def delete_records(self, name: str, record_ids):
+        """
+        Delete the documents of records, e.g. all the chunks of files.
+
+        Parameters:
+            name (str): Table name.
+            record_ids (List[str]): Salesforce records IDs (the Id metadata).
+        """
+
+        with self._lock:
+            table = self._table(name)
+            self._delete_rows(table, self._rows(table, "record", record_ids))
+            self._db.commit()
+
+    def update_metadata(self, name: str, ids, metadatas):
+        """
+        Replace the metadata of documents, keeping their text.
+
+        Parameters:
+            name (str): Table name.
+            ids (List[str]): Documents IDs.
+            metadatas (List[dict]): Documents metadata.
+        """
+
+        with self._lock:
+            table = self._table(name)
+            rows = self._rows(table, "id", ids)
+            updates = [
+                (id, metadata) for id, metadata in zip(ids, metadatas) if id in rows
+            ]
+            self._db.executemany(
+                f"UPDATE {table} SET metadata = ? WHERE rowid = ?",
+                [(json.dumps(metadata), rows[id]) for id, metadata in updates],
+            )
+            self._db.executemany(
+                f"UPDATE {table}_rows SET record = ? WHERE id = ?",
+                [(metadata.get("Id"), id) for id, metadata in updates],
+            )
+            self._db.commit()
+
+    def delete_where(self, name: str, where: dict):
+        """
+        Delete the documents matching a metadata filter.
+
+        Parameters:
+            name (str): Table name.
+            where (dict): Chroma style metadata filter.
+        """
+
+        condition, params = where_to_sql(where)
+        with self._lock:
+            table = self._table(name)
+            rows = self._db.execute(
+                f"SELECT id, rowid FROM {table} WHERE {condition}", params
+            ).fetchall()
+            self._delete_rows(table, dict(rows))
+            self._db.commit()
+
+    def search(
+        self,
+        name: str,
+        query: str,
+        n_results: int = 10,
+        where: dict = None,
+        snippet_tokens: int = 40,
+        match_any: bool = False,
+    ):
+        """
+        Return (metadata, snippet, score) for the best matching documents,
+        best first. The snippet is the text around the match.
+
+        Parameters:
+            name (str): Table name.
+            query (str): Search query, see to_match_expression.
+            n_results (int): Number of documents to return.
+            where (dict): Chroma style metadata filter.
+            snippet_tokens (int): Number of tokens in the snippet.
+            match_any (bool): Match documents holding any word of the query.
+        """
+
+        expression = to_match_expression(query, match_any)
+        if not expression:
+            return []
+        sql = (
+            f"SELECT metadata, snippet({name}, 1, '', '', '...', ?), rank "
+            f"FROM {name} WHERE {name} MATCH ?"
+        )
+        params = [snippet_tokens, expression]
+        if where:
+            condition, where_params = where_to_sql(where)
+            sql += f" AND {condition}"
+            params.extend(where_params)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(n_results)
+
+        with self._lock:
+            self._table(name)
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            (json.loads(metadata), snippet, -rank) for metadata, snippet, rank in rows
+        ]
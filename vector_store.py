@@ -1,19 +1,38 @@
-import magic
-import PyPDF2
+import json
+import hashlib
+import asyncio
 import logging
+import threading
 import chromadb
-import pandas as pd
-from io import BytesIO
+import extraction
 from typing import List
-from schema import Document
-from pptx import Presentation
+from asset_index import AssetIndex
+from embeddings import EmbeddingEngine, LazyEmbeddingFunction, OnnxEmbeddingFunction
+from cache import LRUCache, TextCache
 from salesforce import Salesforce
-from docx import Document as Documentx
-from datetime import datetime, timedelta
+from sync import RecordStream, SyncState, epoch_seconds
+from text_index import TextIndex
+from ingestion import BatchWriter, IngestionPipeline, IngestionStats
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 from chromadb.utils import embedding_functions
 from llama_index.vector_stores.chroma import ChromaVectorStore
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+def fingerprint(text: str, metadata: dict):
+    """
+    Hash of the text and metadata of a collection entry, used to skip
+    writing entries that did not change.
+
+    Parameters:
+        text (str): Entry text.
+        metadata (dict): Entry metadata.
+    """
+
+    metadata = {key: value for key, value in metadata.items() if key != "fingerprint"}
+    payload = json.dumps([text, metadata], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
 
 
 class Vector_Store:
@@ -22,21 +41,103 @@ class Vector_Store:
         sf: Salesforce = None,
         collection_name: str = "test",
         embedding_function=None,
+        download_workers: int = 8,
+        parse_workers: int = None,
+        parse_timeout: float = 60,
+        parse_memory_limit_mb: int = 2048,
+        text_cache_path: str = "cache/text_cache.sqlite3",
+        text_cache_max_size_mb: int = 1024,
+        sync_state_path: str = "cache/sync_state.json",
+        write_batch_size: int = 50,
+        write_queue_size: int = 2,
+        embedding_batch_size: int = 256,
+        query_cache_size: int = 1024,
+        query_cache_ttl: float = 3600,
+        text_index_path: str = "chromaDB/text_index.sqlite3",
+        search_cache_size: int = 256,
+        search_cache_ttl: float = 300,
+        asset_index_path: str = "chromaDB/asset_index.sqlite3",
+        embedding_workers: int = 1,
+        embedding_processes: int = None,
+        encode_batch_size: int = 32,
+        embedding_backend: str = "torch",
+        onnx_model_path: str = "models/multilingual-e5-base-onnx",
+        onnx_model_file: str = "model_quantized.onnx",
     ):
         """
         Parameters:
             sf: Salesforce object to connect with salesforce.
             collection_name (str): Name for the chroma collection.
             embedding_function: Function to create Embedding for the tokens.
+            download_workers (int): Number of threads downloading records while ingesting.
+            parse_workers (int): Number of processes parsing records while ingesting.
+                Default value: number of CPUs.
+            parse_timeout (float): Seconds allowed to parse one file.
+            parse_memory_limit_mb (int): Memory limit of a parsing process in MB.
+            text_cache_path (str): Path of the extracted text cache, None to disable it.
+            text_cache_max_size_mb (int): Maximum size of the extracted text cache in MB.
+            sync_state_path (str): Path of the persisted incremental sync state.
+            write_batch_size (int): Number of records written to the collections at once.
+            write_queue_size (int): Number of batches allowed to wait for the writer.
+            embedding_batch_size (int): Maximum number of entries embedded and sent to
+                Chroma in one call.
+            query_cache_size (int): Number of query embeddings kept in memory.
+            query_cache_ttl (float): Seconds a cached query embedding stays valid.
+            text_index_path (str): Path of the full-text index used by exact search.
+            search_cache_size (int): Number of search results kept in memory.
+            search_cache_ttl (float): Seconds cached search results stay valid, which
+                bounds how far the rolling time windows drift.
+            asset_index_path (str): Path of the local index of Knowledge articles and
+                their linked files.
+            embedding_workers (int): Number of threads embedding queries for the async
+                request path.
+            embedding_processes (int): Number of processes of the default embedding
+                engine, which embeds the documents written to the collections;
+                queries are embedded in process. Default value: number of CPUs,
+                at most 4.
+            encode_batch_size (int): Number of chunks encoded at once by an embedding
+                process.
+            embedding_backend (str): Default embedding function: 'torch' for the
+                multi-process PyTorch engine, 'onnx' for a local ONNX Runtime export.
+            onnx_model_path (str): Directory of the ONNX export, see
+                embedding_benchmark.py.
+            onnx_model_file (str): ONNX model file, e.g. the int8 quantized one.
         """
 
         chroma_client = chromadb.PersistentClient(path="chromaDB")
+
+        def default_embedding_function():
+            if embedding_backend == "onnx":
+                return OnnxEmbeddingFunction(
+                    onnx_model_path,
+                    model_file=onnx_model_file,
+                    batch_size=encode_batch_size,
+                )
+            return EmbeddingEngine(
+                model_name="intfloat/multilingual-e5-base",
+                workers=embedding_processes,
+                batch_size=encode_batch_size,
+            )
+
         __embedding_function = (
             embedding_function
             if embedding_function
-            else embedding_functions.SentenceTransformerEmbeddingFunction(
+            else LazyEmbeddingFunction(default_embedding_function)
+        )
+        self.embedding_function = __embedding_function
+
+        def default_query_embedding_function():
+            # In process, so a query never waits behind queued ingest batches.
+            if embedding_backend == "onnx":
+                return self.embedding_function.load()
+            return embedding_functions.SentenceTransformerEmbeddingFunction(
                 model_name="intfloat/multilingual-e5-base"
             )
+
+        self.query_embedding_function = (
+            embedding_function
+            if embedding_function
+            else LazyEmbeddingFunction(default_query_embedding_function)
         )
         self.files_semantic_collection = chroma_client.get_or_create_collection(
             name=collection_name, embedding_function=__embedding_function
@@ -53,6 +154,38 @@ class Vector_Store:
 
         self.sf = sf
         self.records_ids = []
+        self.extractor = extraction.Extractor(
+            workers=parse_workers,
+            timeout=parse_timeout,
+            memory_limit_mb=parse_memory_limit_mb,
+        )
+        self.text_cache = (
+            TextCache(text_cache_path, max_size_mb=text_cache_max_size_mb)
+            if text_cache_path
+            else None
+        )
+        self.pipeline = IngestionPipeline(
+            sf,
+            download_workers=download_workers,
+            extractor=self.extractor,
+            text_cache=self.text_cache,
+        )
+        self.sync_state = SyncState(sync_state_path)
+        self.text_index = TextIndex(text_index_path)
+        self.asset_index = AssetIndex(asset_index_path)
+        self.query_embeddings = LRUCache(max_size=query_cache_size, ttl=query_cache_ttl)
+        self.embedding_executor = ThreadPoolExecutor(
+            embedding_workers, thread_name_prefix="embedding"
+        )
+        self.write_batch_size = write_batch_size
+        self.write_queue_size = write_queue_size
+        self.embedding_batch_size = min(
+            embedding_batch_size,
+            getattr(chroma_client, "max_batch_size", embedding_batch_size),
+        )
+        self.search_results = LRUCache(max_size=search_cache_size, ttl=search_cache_ttl)
+        self.generation = 0
+        self._generation_lock = threading.Lock()
 
     def FileType(self, file_bytes: str):
         """
@@ -62,9 +195,7 @@ class Vector_Store:
             file_bytes (str): bytes for the file as str.
         """
 
-        mime = magic.Magic(mime=True)
-        file_type = mime.from_buffer(file_bytes)
-        return file_type
+        return extraction.file_type(file_bytes)
 
     def bytes_to_string(self, bytes: str):
         """
@@ -74,92 +205,189 @@ class Vector_Store:
             bytes (bytes): The file in bytes.
         """
 
-        fileType = self.FileType(bytes)
-        fileText = ""
+        return self.extractor.extract(bytes)
 
-        # CSV files.
-        if fileType == "text/csv":
-            fileText = str(bytes)
-            return fileText
+    def embed_query(self, query: str):
+        """
+        Embed the query once and share the vector between the semantic
+        collections, reusing cached vectors of recent queries.
 
-        # Excel files.
-        elif fileType == "application/vnd.ms-excel":
-            xls = pd.read_excel(BytesIO(bytes), sheet_name=None)
-            csv_data = {}
-            for sheet_name, df in xls.items():
-                csv_data[sheet_name] = df.to_csv(index=False)
-            fileText = str(csv_data)
-            return fileText
+        Parameters:
+            query (str): Search query.
+        """
 
-        # Powerpoint files.
-        elif (
-            fileType
-            == "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-        ):
-            prs = Presentation(BytesIO(bytes))
-            text = []
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text.append(shape.text)
-            fileText = "\n".join(text)
-            return fileText
-
-        # Text files.
-        elif fileType == "text/plain":
-            fileText = bytes.decode("utf-8")
-            return fileText
-
-        # Word files.
-        elif (
-            fileType
-            == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        ):
-            doc = Documentx(BytesIO(bytes))
-            fileText = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return fileText
+        embedding = self.query_embeddings.get(query)
+        if embedding is None:
+            embedding = self.query_embedding_function([query])[0]
+            embedding = [float(value) for value in embedding]
+            self.query_embeddings.put(query, embedding)
+        return embedding
 
-        # PDF files.
-        elif fileType == "application/pdf":
-            pdf_reader = PyPDF2.PdfReader(BytesIO(bytes))
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                fileText += page.extract_text()
-            return fileText
+    def load_embedding_model(self):
+        """
+        Load the embedding models now instead of on the first embedding. The
+        workers of the embedding engine only start on the first write.
+        """
+
+        for function in (self.embedding_function, self.query_embedding_function):
+            if isinstance(function, LazyEmbeddingFunction):
+                function.load()
+
+    def _embedding_engine(self):
+        function = self.embedding_function
+        if isinstance(function, LazyEmbeddingFunction):
+            function = function.load() if function.loaded else None
+        return function if hasattr(function, "stats") else None
+
+    def _close_embedding_engine(self):
+        # The engine workers hold a model copy each, stop them between passes.
+        engine = self._embedding_engine()
+        if engine and hasattr(engine, "close"):
+            engine.close()
+
+    def embedding_stats(self):
+        """
+        Return the throughput of the embedding engine, None when the
+        embedding function does not report it.
+        """
+
+        engine = self._embedding_engine()
+        return engine.stats() if engine else None
+
+    async def aembed_query(self, query: str):
+        """
+        Embed the query on the embedding executor, keeping the model off the
+        event loop and off the threads running the collection queries. The
+        vector lands in the query cache, where the searches pick it up.
+
+        Parameters:
+            query (str): Search query.
+        """
+
+        embedding = self.query_embeddings.get(query)
+        if embedding is None:
+            loop = asyncio.get_running_loop()
+            embedding = await loop.run_in_executor(
+                self.embedding_executor, self.embed_query, query
+            )
+        return embedding
+
+    def cache_stats(self):
+        """
+        Return the hit rate statistics of the in-memory caches.
+        """
+
+        return {
+            "query_embeddings": self.query_embeddings.stats(),
+            "search_results": self.search_results.stats(),
+            "generation": self.generation,
+            "embedding": self.embedding_stats(),
+        }
+
+    def bump_generation(self):
+        """
+        Invalidate the cached search results after the collections changed.
+        """
 
-        # Other files
-        else:
-            print(f"unsuported filetype: {fileType}")
+        with self._generation_lock:
+            self.generation += 1
+        self.search_results.clear()
 
-    def time_filters(self, **kwargs):
+    async def acached_search(self, endpoint: str, search, query: str, **params):
         """
-        Create time filters for the search.
+        Return the cached results of a search, or await search and cache its
+        results. The key holds the generation, so results computed before an
+        ingest are never served after it.
+
+        Parameters:
+            endpoint (str): Name of the search.
+            search: Callable returning an awaitable of the search results.
+            query (str): Search query, normalised for the key.
+            params: Other search parameters, part of the key.
+        """
+
+        key = self._search_key(endpoint, query, params)
+        results = self.search_results.get(key)
+        if results is None:
+            results = await search()
+            self.search_results.put(key, results)
+        return results
+
+    def _search_key(self, endpoint: str, query: str, params: dict):
+        return (
+            self.generation,
+            endpoint,
+            " ".join(query.casefold().split()),
+            json.dumps(params, sort_keys=True, default=str),
+        )
+
+    def time_filters(
+        self,
+        last_day: bool = False,
+        last_month: bool = False,
+        last_year: bool = False,
+        date_from: str = None,
+        date_to: str = None,
+    ):
+        """
+        Create a CreatedTimestamp range filter for the search, applied inside
+        the index before the top results are picked. The last_* flags are
+        rolling windows ending now; date_from and date_to are ISO dates or
+        datetimes (UTC unless given), a date_to without time includes that day.
+        Raise ValueError when a date is not in ISO format.
 
         Parameters:
             last_day (bool): Search for records created in the last day.
             last_month (bool): Search for records created in the last month.
             last_year (bool): Search for records created in the last year.
+            date_from (str): Search for records created from this date.
+            date_to (str): Search for records created until this date.
         """
-        current_date = datetime.now()
-        if kwargs["last_day"]:
-            last_day_datetime = str((current_date - timedelta(days=1)).date())
-            print(f"last_day_datetime: {last_day_datetime}")
-            print(f"Type of last_day_datetime: {type(last_day_datetime)}")
-            return last_day_datetime
-        if kwargs["last_month"]:
-            last_month_datetime = "-".join(
-                str((current_date - relativedelta(months=1)).date()).split("-")[:2]
-            )
-            print(f"Type of last_month_datetime: {type(last_month_datetime)}")
-            print(f"last_month_datetime: {last_month_datetime}")
-            return last_month_datetime
-        if kwargs["last_year"]:
-            last_year_datetime = str(
-                (current_date - relativedelta(years=1)).date()
-            ).split("-")[0]
-            print(f"last_year_datetime: {last_year_datetime}")
-            print(f"Type of last_year_datetime: {type(last_year_datetime)}")
-            return last_year_datetime
+
+        def timestamp(value: str, end_of_day: bool = False):
+            try:
+                moment = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(
+                    f"{value!r} is not an ISO date (YYYY-MM-DD) or datetime."
+                )
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            if end_of_day and len(value) == 10:
+                moment += timedelta(days=1, seconds=-1)
+            return int(moment.timestamp())
+
+        current_date = datetime.now(timezone.utc)
+        start = timestamp(date_from) if date_from else None
+        end = timestamp(date_to, end_of_day=True) if date_to else None
+        if last_day:
+            start = int((current_date - timedelta(days=1)).timestamp())
+        elif last_month:
+            start = int((current_date - relativedelta(months=1)).timestamp())
+        elif last_year:
+            start = int((current_date - relativedelta(years=1)).timestamp())
+
+        clauses = []
+        if start is not None:
+            clauses.append({"CreatedTimestamp": {"$gte": start}})
+        if end is not None:
+            clauses.append({"CreatedTimestamp": {"$lte": end}})
+        return self.combine_filters(*clauses)
+
+    def combine_filters(self, *filters):
+        """
+        AND several where filters together, skipping the empty ones.
+
+        Parameters:
+            filters (dict): Where filters.
+        """
+
+        filters = [where for where in filters if where]
+        if not filters:
+            return None
+        if len(filters) == 1:
+            return filters[0]
+        return {"$and": filters}
 
     def filters(self, **kwargs):
         """
@@ -193,55 +421,159 @@ class Vector_Store:
 
     def combine_files_with_assets(self, result_files):
         """
-        Combine assets and files into a single dictionary.
+        Group the files under the Knowledge articles they are attached to,
+        using the local asset index, so no Salesforce call is made. Files not
+        attached to an article, or ingested without their ContentDocumentId,
+        are left out.
 
         Parameters:
-            assets (List[Dict]): List of assets.
-            files (List[Dict]): List of files.
+            result_files (List[Dict]): Files search results.
         """
-        list_of_ids = []
-        assets_files_list = []
-        try:
-            for idx, file in enumerate(result_files):
-                file_asset = self.sf.get_asset_by_Id(file["ContentDocumentId"])
-                if file_asset["Id"] not in list_of_ids:
-                    asset_dict = {
-                        "Asset_Id": file_asset["Id"],
-                        "Asset_Title": file_asset["Title"],
-                        "Creation_Date": file_asset["CreatedDate"]
-                        .split("T")[0]
-                        .replace("-", "/"),
-                        "Description": file_asset["Description__c"],
-                        "Asset_Url": file_asset["URL__c"],
-                        "Asset_Files": [file],
-                    }
-                    assets_files_list.append(asset_dict)
-                    list_of_ids.append(file_asset["Id"])
-                else:
-                    assets_files_list[idx].append(file)
-        except Exception as e:
-            print(e)
-        return assets_files_list
-
-        # for asset in assets:
-        #     if asset["Id"] in assets_files_dict:
-        #         assets_files_dict[asset["Id"]]["asset_description"] = asset["Description__c"]
-        #         assets_files_dict[asset["Id"]]["asset_url"] = asset["URL__c"]
-        #     else:
-        #         assets_files_dict[asset["Id"]] = {
-        #             "asset_id": asset["Id"],
-        #             "asset_title": asset["Title"],
-        #             "creation_date": asset["CreatedDate"],
-        #             "description": asset["Description__c"],
-        #             "asset_url": asset["URL__c"],
-        #             "asset_files": [],
-        #         }
-        # return assets_files_dict
+
+        assets = self.asset_index.assets_by_document(
+            {
+                file["ContentDocumentId"]
+                for file in result_files
+                if file.get("ContentDocumentId")
+            }
+        )
+        assets_files = {}
+        for file in result_files:
+            file_asset = assets.get(file.get("ContentDocumentId"))
+            if file_asset is None:
+                continue
+            if file_asset["Id"] not in assets_files:
+                assets_files[file_asset["Id"]] = {
+                    "Asset_Id": file_asset["Id"],
+                    "Asset_Title": file_asset["Title"],
+                    "Creation_Date": file_asset["CreatedDate"]
+                    .split("T")[0]
+                    .replace("-", "/"),
+                    "Description": file_asset.get("Description__c"),
+                    "Asset_Url": file_asset.get("URL__c"),
+                    "Asset_Files": [],
+                }
+            assets_files[file_asset["Id"]]["Asset_Files"].append(file)
+        return list(assets_files.values())
 
     def combine_assets_with_files(self):
         pass
 
-    def init_vector_semantic(
+    def _stream_records(
+        self,
+        metadata: List[str],
+        From: str = "",
+        Where: str = "",
+        OrderBy: str = "",
+        Limit: str = "",
+    ):
+        """
+        Stream records with their metadata from Salesforce, see RecordStream
+        for the IDs and watermark it collects.
+        """
+
+        return RecordStream(
+            self.sf, metadata, From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+        )
+
+    def _sync_key(self, From: str, Where: str):
+        return f"{From}|{Where}"
+
+    def _known_ids(self, From: str, Where: str, OrderBy: str = "", Limit: str = ""):
+        """
+        Return the IDs of the records in the store from the persisted sync
+        state, listing them from Salesforce only when no state was saved.
+        """
+
+        ids = self.sync_state.get(self._sync_key(From, Where))["ids"]
+        if ids:
+            return sorted(ids)
+        return self.sf.get_records_ids(
+            From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+        )
+
+    def _save_sync_state(
+        self, From: str, Where: str, records: RecordStream, complete: bool = True
+    ):
+        # Without a complete pass the next sync starts over from scratch.
+        if records.watermark and complete:
+            self.sync_state.set(
+                self._sync_key(From, Where),
+                watermark=records.watermark,
+                ids=records.ids,
+            )
+
+    def _backfill_text_index(self, collection, name: str, page_size: int = 500):
+        """
+        Fill an empty full-text index table from a collection, for stores
+        created before the index existed.
+
+        Parameters:
+            collection: Chroma collection.
+            name (str): Text index table name.
+            page_size (int): Number of entries read from the collection at once.
+        """
+
+        total = collection.count()
+        if total == 0 or self.text_index.count(name) > 0:
+            return
+        for offset in range(0, total, page_size):
+            entries = collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            metadatas = [
+                {key: value for key, value in metadata.items() if key != "fingerprint"}
+                for metadata in entries["metadatas"]
+            ]
+            self.text_index.upsert(
+                name, entries["ids"], entries["documents"], metadatas
+            )
+        logging.info(f"indexed {total} documents from {collection.name} for search")
+
+    def _backfill_timestamps(self, collection, name: str, page_size: int = 500):
+        """
+        Add CreatedTimestamp to entries ingested before it existed, in the
+        collection and the matching text index table, without re-embedding.
+        Runs once per collection, new entries get it at ingest.
+
+        Parameters:
+            collection: Chroma collection.
+            name (str): Text index table holding the same entries.
+            page_size (int): Number of entries read from the collection at once.
+        """
+
+        migration = f"CreatedTimestamp:{collection.name}"
+        if self.sync_state.migrated(migration):
+            return
+        total = collection.count()
+        updated = 0
+        for offset in range(0, total, page_size):
+            entries = collection.get(
+                include=["metadatas"], limit=page_size, offset=offset
+            )
+            ids, metadatas = [], []
+            for id, metadata in zip(entries["ids"], entries["metadatas"]):
+                created = metadata.get("CreatedDate")
+                if created and "CreatedTimestamp" not in metadata:
+                    metadata["CreatedTimestamp"] = epoch_seconds(created)
+                    ids.append(id)
+                    metadatas.append(metadata)
+            if ids:
+                collection.update(ids=ids, metadatas=metadatas)
+                self.text_index.update_metadata(
+                    name,
+                    ids,
+                    [
+                        {key: value for key, value in m.items() if key != "fingerprint"}
+                        for m in metadatas
+                    ],
+                )
+                updated += len(ids)
+        if updated:
+            logging.info(f"added CreatedTimestamp to {updated} entries of {name}")
+        self.sync_state.set_migrated(migration)
+
+    def init_files(
         self,
         metadata: List[str] = ["Id", "Title"],
         chunk_size=1000,
@@ -250,51 +582,81 @@ class Vector_Store:
         Where: str = "",
         OrderBy: str = "",
         Limit: str = "",
+        semantic: bool = True,
+        exact: bool = True,
+        force: bool = False,
     ):
         """
-        Pull records from Salesforce to Chroma vector store with Text Splitter for semantic search.
+        Pull records from Salesforce once and feed both the semantic collection
+        (split into chunks) and the exact collection (whole documents). A
+        collection that is already populated is left untouched unless force
+        is set, in which case only missing or changed chunks are rewritten.
 
         Parameters:
+            metadata (List[str]): List of metadata fields to retrieve. Default fields are 'Id' and 'Title'.
             chunk_size (int): The size of each chunk in bytes.
             chunk_overlap (int): The size of the overlap between adjacent chunks.
             From (str): Name of the Salesforce object from which to retrieve records.
             Where (str): SQL WHERE clause to filter records.
             OrderBy (str): SQL ORDER BY clause to sort records.
             Limit (str): SQL LIMIT clause to limit the number of records retrieved.
+            semantic (bool): Fill the semantic collection.
+            exact (bool): Fill the exact collection.
+            force (bool): Re-ingest into populated collections.
         """
 
-        self.records_ids = self.sf.get_records_ids(
-            From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
-        )
-        if self.files_semantic_collection.count() == 0:
+        self._backfill_text_index(self.files_exact_collection, "files")
+        self._backfill_text_index(self.files_semantic_collection, "chunks")
+        self._backfill_timestamps(self.files_exact_collection, "files")
+        self._backfill_timestamps(self.files_semantic_collection, "chunks")
+        semantic = semantic and (force or self.files_semantic_collection.count() == 0)
+        exact = exact and (force or self.files_exact_collection.count() == 0)
+        if not (semantic or exact):
+            self.records_ids = self._known_ids(From, Where, OrderBy, Limit)
+            return
 
-            documents = []
+        # Ids and metadata stream from one paginated query, downloads start
+        # as soon as the first page arrives.
+        records = self._stream_records(metadata, From, Where, OrderBy, Limit)
+        _, _, complete = self._write_files(
+            records, chunk_size, chunk_overlap, semantic=semantic, exact=exact
+        )
+        self._save_sync_state(From, Where, records, complete)
+        self.records_ids = records.ids
+        self.bump_generation()
 
-            for id in self.records_ids:
-                # Get text and metadata for the record
-                record_bytes = self.sf.get_record_by_id(id)
-                if self.bytes_to_string(record_bytes):
-                    record_text = self.bytes_to_string(record_bytes)
-                else:
-                    continue
-                record_metadata = self.sf.get_metadata_by_id(
-                    id, metadata_fields=metadata, From=From
-                )
+    def init_vector_semantic(
+        self,
+        metadata: List[str] = ["Id", "Title"],
+        chunk_size=1000,
+        chunk_overlap=20,
+        From: str = "",
+        Where: str = "",
+        OrderBy: str = "",
+        Limit: str = "",
+    ):
+        """
+        Pull records from Salesforce to Chroma vector store with Text Splitter for semantic search.
 
-                # create document
-                doc = Document(page_content=record_text, metadata=record_metadata)
-                documents.append(doc)
+        Parameters:
+            chunk_size (int): The size of each chunk in bytes.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            From (str): Name of the Salesforce object from which to retrieve records.
+            Where (str): SQL WHERE clause to filter records.
+            OrderBy (str): SQL ORDER BY clause to sort records.
+            Limit (str): SQL LIMIT clause to limit the number of records retrieved.
+        """
 
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size, chunk_overlap=chunk_overlap
-            )
-            splits = text_splitter.split_documents(documents)
-            splits_text = [splits[i].page_content for i in range(len(splits))]
-            splits_metadata = [splits[i].metadata for i in range(len(splits))]
-            splits_id = [str(i) for i in range(len(splits))]
-            self.files_semantic_collection.add(
-                ids=splits_id, documents=splits_text, metadatas=splits_metadata
-            )
+        self.init_files(
+            metadata=metadata,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            From=From,
+            Where=Where,
+            OrderBy=OrderBy,
+            Limit=Limit,
+            exact=False,
+        )
 
     def init_vector_exact(
         self,
@@ -314,27 +676,80 @@ class Vector_Store:
             OrderBy (str): SQL ORDER BY clause to sort records.
             Limit (str): SQL LIMIT clause to limit the number of records retrieved.
         """
-        self.records_ids = self.sf.get_records_ids(
-            From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+
+        self.init_files(
+            metadata=metadata,
+            From=From,
+            Where=Where,
+            OrderBy=OrderBy,
+            Limit=Limit,
+            semantic=False,
         )
-        if self.files_exact_collection.count() == 0:
-            documents_data_list = []
-            documents_metadata_list = []
-            for id in self.records_ids:
-                record_bytes = self.sf.get_record_by_id(id)
-                if self.bytes_to_string(record_bytes):
-                    documents_data_list.append(self.bytes_to_string(record_bytes))
-                else:
-                    continue
-                documents_metadata_list.append(
-                    self.sf.get_metadata_by_id(id, metadata_fields=metadata, From=From)
-                )
-            documents_ids_list = [str(i) for i in range(len(documents_data_list))]
-            self.files_exact_collection.add(
-                ids=documents_ids_list,
-                metadatas=documents_metadata_list,
-                documents=documents_data_list,
-            )
+
+    def init_assets(
+        self,
+        metadata: List[str] = ["Id", "Title"],
+        From: str = "",
+        Where: str = "",
+        OrderBy: str = "",
+        Limit: str = "",
+        semantic: bool = True,
+        exact: bool = True,
+        force: bool = False,
+    ):
+        """
+        Pull Knowledge articles from Salesforce once and feed both the semantic
+        and the exact assets collections. A collection that is already
+        populated is left untouched unless force is set, in which case only
+        missing or changed articles are rewritten.
+
+        Parameters:
+            metadata (List[str]): List of metadata fields to retrieve, must include
+                'KnowledgeArticleId' and 'Summary'.
+            From (str): Name of the Salesforce object from which to retrieve records.
+            Where (str): SQL WHERE clause to filter records.
+            OrderBy (str): SQL ORDER BY clause to sort records.
+            Limit (str): SQL LIMIT clause to limit the number of records retrieved.
+            semantic (bool): Fill the semantic assets collection.
+            exact (bool): Fill the exact assets collection.
+            force (bool): Re-ingest into populated collections.
+        """
+
+        self._backfill_text_index(self.assets_exact_collection, "assets")
+        semantic = semantic and (force or self.assets_semantic_collection.count() == 0)
+        exact = exact and (force or self.assets_exact_collection.count() == 0)
+        if not (semantic or exact):
+            if self.asset_index.count() == 0:
+                # Fill the asset index of a store created before it existed.
+                records = self._stream_records(metadata, From, Where, OrderBy, Limit)
+                self._write_assets(records, semantic=False, exact=False)
+            else:
+                self.records_ids = self._known_ids(From, Where, OrderBy, Limit)
+            return
+
+        records = self._stream_records(metadata, From, Where, OrderBy, Limit)
+        _, _, complete = self._write_assets(records, semantic=semantic, exact=exact)
+        self._save_sync_state(From, Where, records, complete)
+        self.records_ids = records.ids
+        self.bump_generation()
+
+    def _asset_document(self, asset_data: dict):
+        """
+        Build the text and metadata stored for a Knowledge article, or None
+        when it has neither a title nor a summary.
+
+        Parameters:
+            asset_data (dict): Knowledge article fields.
+        """
+
+        asset_metadata = {}
+        asset_metadata["Id"] = asset_data["Id"]
+        asset_metadata["KnowledgeArticleId"] = asset_data["KnowledgeArticleId"]
+        asset_title = asset_data["Title"]
+        asset_summary = asset_data["Summary"]
+        if asset_title or asset_summary:
+            return f"{asset_title} {asset_summary}", asset_metadata
+        return None
 
     def init_vector_assets(
         self,
@@ -344,31 +759,14 @@ class Vector_Store:
         OrderBy: str = "",
         Limit: str = "",
     ):
-        self.records_ids = self.sf.get_records_ids(
-            From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+        self.init_assets(
+            metadata=metadata,
+            From=From,
+            Where=Where,
+            OrderBy=OrderBy,
+            Limit=Limit,
+            exact=False,
         )
-        if self.assets_semantic_collection.count() == 0:
-            documents_data_list = []
-            documents_metadata_list = []
-            for id in self.records_ids:
-                asset_data, asset_metadata = {}, {}
-                asset_data = self.sf.get_metadata_by_id(
-                    id, metadata_fields=metadata, From="Knowledge__kav"
-                )
-                asset_metadata["Id"] = asset_data["Id"]
-                asset_metadata["KnowledgeArticleId"] = asset_data["KnowledgeArticleId"]
-                asset_title = asset_data["Title"]
-                asset_summary = asset_data["Summary"]
-                if asset_title or asset_summary:
-                    documents_data_list.append(f"{asset_title} {asset_summary}")
-                else:
-                    continue
-                documents_metadata_list.append(asset_metadata)
-            self.assets_semantic_collection.add(
-                ids=[str(id) for id in range(len(documents_data_list))],
-                metadatas=documents_metadata_list,
-                documents=documents_data_list,
-            )
 
     def init_vector_assets_exact(
         self,
@@ -378,31 +776,61 @@ class Vector_Store:
         OrderBy: str = "",
         Limit: str = "",
     ):
-        self.records_ids = self.sf.get_records_ids(
-            From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
+        self.init_assets(
+            metadata=metadata,
+            From=From,
+            Where=Where,
+            OrderBy=OrderBy,
+            Limit=Limit,
+            semantic=False,
         )
-        if self.assets_exact_collection.count() == 0:
-            documents_data_list = []
-            documents_metadata_list = []
-            for id in self.records_ids:
-                asset_data, asset_metadata = {}, {}
-                asset_data = self.sf.get_metadata_by_id(
-                    id, metadata_fields=metadata, From="Knowledge__kav"
-                )
-                asset_metadata["Id"] = asset_data["Id"]
-                asset_metadata["KnowledgeArticleId"] = asset_data["KnowledgeArticleId"]
-                asset_title = asset_data["Title"]
-                asset_summary = asset_data["Summary"]
-                if asset_title or asset_summary:
-                    documents_data_list.append(f"{asset_title} {asset_summary}")
-                else:
+
+    def _top_k(
+        self,
+        collection,
+        n_results: int,
+        max_distance: float = None,
+        overfetch: int = 4,
+        **query,
+    ):
+        """
+        Ask the index for a small over-fetch of n_results instead of the whole
+        collection, and double the request while deduplication per record or
+        max_distance leave too few results. Return (metadata, document) pairs,
+        one per record, best first.
+
+        Parameters:
+            collection: Chroma collection.
+            n_results (int): Number of records to return.
+            max_distance (float): Maximum distance between the query and documents.
+            overfetch (int): Entries fetched per requested record at first.
+            query: Arguments passed to collection.query.
+        """
+
+        total = collection.count()
+        n_fetch = min(total, max(n_results, 1) * overfetch)
+        while n_fetch > 0:
+            matches = collection.query(n_results=n_fetch, **query)
+            ids = matches["ids"][0]
+            distances = matches["distances"][0] if matches["distances"] else None
+            exhausted = len(ids) < n_fetch or n_fetch >= total
+            results, seen = [], set()
+            for i in range(len(ids)):
+                # Results are sorted by distance, nothing further can qualify.
+                if max_distance is not None and distances[i] >= max_distance:
+                    exhausted = True
+                    break
+                metadata = matches["metadatas"][0][i]
+                if metadata["Id"] in seen:
                     continue
-                documents_metadata_list.append(asset_metadata)
-            self.assets_exact_collection.add(
-                ids=[str(id) for id in range(len(documents_data_list))],
-                metadatas=documents_metadata_list,
-                documents=documents_data_list,
-            )
+                seen.add(metadata["Id"])
+                results.append((metadata, matches["documents"][0][i]))
+                if len(results) >= n_results:
+                    return results
+            if exhausted:
+                return results
+            n_fetch = min(total, n_fetch * 2)
+        return []
 
     def files_semantic_search(
         self,
@@ -410,7 +838,7 @@ class Vector_Store:
         n_results: int = 10,
         max_distance: float = 1.8,
         filters: dict = None,
-        time_filter: str = None,
+        time_filter: dict = None,
     ):
         """
         Search the vector store of attachments with a query
@@ -419,41 +847,28 @@ class Vector_Store:
             query (str): Search query.
             n_results (int): Number of retrieved records.
             max_distance (float): Maximum distance between the query and documents.
+            filters (dict): Metadata filters.
+            time_filter (dict): CreatedTimestamp range, see time_filters.
         """
 
-        matching_docs = self.files_semantic_collection.query(
-            query_texts=[query],
-            n_results=self.files_semantic_collection.count(),
-            where=filters,
-        )
-        unique_list = []
+        results_list = []
         try:
-            results_list = []
-            # print(f"Matching docs: {matching_docs} from (files_semantic_search)")
-            for i in range(self.files_semantic_collection.count()):
-                print(i)
-                if matching_docs["metadatas"][0][i]["Id"] not in unique_list:
-                    if matching_docs["distances"][0][i] < max_distance:
-                        unique_list.append(matching_docs["metadatas"][0][i]["Id"])
-                        matching_docs["metadatas"][0][i]["preview"] = (
-                            matching_docs["documents"][0][i] + "..."
-                        ).replace("\n", "")
-                        matching_docs["metadatas"][0][i][
-                            "url"
-                        ] = f"http://0.0.0.0:8000/records/download?id={matching_docs['metadatas'][0][i]['Id']}"
-                        results_list.append(matching_docs["metadatas"][0][i])
-                    if len(unique_list) >= n_results:
-                        break
+            matching_docs = self._top_k(
+                self.files_semantic_collection,
+                n_results,
+                max_distance=max_distance,
+                query_embeddings=[self.embed_query(query)],
+                where=self.combine_filters(filters, time_filter),
+            )
+            for metadata, document in matching_docs:
+                metadata.pop("fingerprint", None)
+                metadata["preview"] = (document + "...").replace("\n", "")
+                metadata[
+                    "url"
+                ] = f"http://0.0.0.0:8000/records/download?id={metadata['Id']}"
+                results_list.append(metadata)
         except Exception as e:
             print(f"Error: {e}")
-        if time_filter:
-            print(time_filter)
-            print(type(time_filter))
-            time_filtered_resultes = [
-                doc for doc in results_list if time_filter in doc["CreatedDate"]
-            ]
-            print(time_filtered_resultes)
-            return time_filtered_resultes
         return results_list
 
     def assets_semantic_search(
@@ -461,32 +876,23 @@ class Vector_Store:
         query: str,
         n_results: int = 10,
         max_distance: float = 1.8,
-        # filters: dict = None,
-        # time_filters: str = None,
     ):
         """
         Search the vector store of assets with a query
         """
-        matching_assets = self.assets_semantic_collection.query(
-            query_texts=[query],
-            n_results=self.assets_semantic_collection.count(),
-            # where=filters,
-        )
-        # print(f"Macthing assets: {matching_assets} from assets_semantic_search")
-        # print(f"Fitlers: {filters} from (assets_semantic_search)")
-        unique_list = []
+
+        results_list = []
         try:
-            results_list = []
-            for i in range(self.assets_semantic_collection.count()):
-                if matching_assets["metadatas"][0][i]["Id"] not in unique_list:
-                    if matching_assets["distances"][0][i] < max_distance:
-                        unique_list.append(matching_assets["metadatas"][0][i]["Id"])
-                        matching_assets["metadatas"][0][i]["preview"] = (
-                            matching_assets["documents"][0][i] + "..."
-                        ).replace("\n", "")
-                        results_list.append(matching_assets["metadatas"][0][i])
-                    if len(unique_list) >= n_results:
-                        break
+            matching_assets = self._top_k(
+                self.assets_semantic_collection,
+                n_results,
+                max_distance=max_distance,
+                query_embeddings=[self.embed_query(query)],
+            )
+            for metadata, document in matching_assets:
+                metadata.pop("fingerprint", None)
+                metadata["preview"] = (document + "...").replace("\n", "")
+                results_list.append(metadata)
         except Exception as e:
             print(f"Error: {e}")
         return results_list
@@ -496,40 +902,35 @@ class Vector_Store:
         search_query: str,
         n_results: int = 10,
         filters: dict = None,
-        time_filter: str = None,
+        time_filter: dict = None,
     ):
-        matching_docs = self.files_exact_collection.query(
-            query_texts=[search_query],
-            n_results=self.files_exact_collection.count(),
-            where_document={"$contains": search_query},
-            where=filters,
-        )
-        unique_list = []
+        """
+        Search the full-text index of attachments, best BM25 match first. The
+        query is a phrase; quoted phrases and word* prefixes can be combined.
+
+        Parameters:
+            search_query (str): Search query.
+            n_results (int): Number of retrieved records.
+            filters (dict): Metadata filters.
+            time_filter (dict): CreatedTimestamp range, see time_filters.
+        """
+
+        results_list = []
         try:
-            results_list = []
-            for i in range(len(matching_docs["ids"][0])):
-                if matching_docs["metadatas"][0][i]["Id"] not in unique_list:
-                    unique_list.append(matching_docs["metadatas"][0][i]["Id"])
-                    matching_docs["metadatas"][0][i]["preview"] = (
-                        matching_docs["documents"][0][i][:300] + "..."
-                    ).replace("\n", "")
-                    matching_docs["metadatas"][0][i][
-                        "url"
-                    ] = f"http://0.0.0.0:8000/records/download?id={matching_docs['metadatas'][0][i]['Id']}"
-                    results_list.append(matching_docs["metadatas"][0][i])
-                if len(unique_list) >= n_results:
-                    break
+            matching_docs = self.text_index.search(
+                "files",
+                search_query,
+                n_results,
+                where=self.combine_filters(filters, time_filter),
+            )
+            for metadata, snippet, _ in matching_docs:
+                metadata["preview"] = (snippet + "...").replace("\n", "")
+                metadata[
+                    "url"
+                ] = f"http://0.0.0.0:8000/records/download?id={metadata['Id']}"
+                results_list.append(metadata)
         except Exception as e:
             print(e)
-
-        if time_filter:
-            print(time_filter)
-            print(type(time_filter))
-            time_filtered_resultes = [
-                doc for doc in results_list if time_filter in doc["CreatedDate"]
-            ]
-            print(time_filtered_resultes)
-            return time_filtered_resultes
         return results_list
 
     def assets_exact_search(
@@ -537,31 +938,572 @@ class Vector_Store:
         search_query: str,
         n_results: int = 1,
     ):
-        matching_assets = self.assets_exact_collection.query(
-            query_texts=[search_query],
-            n_results=self.assets_exact_collection.count(),
-            where_document={"$contains": search_query},
+        matching_assets = self.text_index.search(
+            "assets", search_query, n_results, snippet_tokens=15
         )
-        unique_list = []
         results_list = []
-        for i in range(len(matching_assets["ids"][0])):
-            if matching_assets["metadatas"][0][i]["Id"] not in unique_list:
-                unique_list.append(matching_assets["metadatas"][0][i]["Id"])
-                matching_assets["metadatas"][0][i]["preview"] = (
-                    matching_assets["documents"][0][i][:100] + "..."
-                ).replace("\n", "")
-                results_list.append(matching_assets["metadatas"][0][i])
-            if len(unique_list) >= n_results:
-                break
+        for metadata, snippet, _ in matching_assets:
+            metadata["preview"] = (snippet + "...").replace("\n", "")
+            results_list.append(metadata)
         return results_list
 
+    def _hybrid(
+        self,
+        collection,
+        table: str,
+        query: str,
+        n_results: int,
+        where: dict = None,
+        candidates: int = 20,
+        k: int = 60,
+    ):
+        """
+        Rank records with the vector index and the BM25 index over the same
+        entries and merge both rankings with reciprocal-rank fusion: a record
+        scores sum(1 / (k + rank)) over the rankings it appears in. Return
+        (metadata, preview, score) triples, best first.
+
+        Parameters:
+            collection: Chroma collection.
+            table (str): Text index table holding the same entries.
+            query (str): Search query.
+            n_results (int): Number of records to return.
+            where (dict): Metadata filters.
+            candidates (int): Number of records taken from each ranking.
+            k (int): Fusion constant, damping the weight of the top ranks.
+        """
+
+        n_candidates = max(candidates, n_results)
+        vector_ranking = self._top_k(
+            collection,
+            n_candidates,
+            query_embeddings=[self.embed_query(query)],
+            where=where,
+        )
+        lexical_ranking, seen = [], set()
+        # Several chunks of a record can match, fetch enough to fill the ranking.
+        for metadata, snippet, _ in self.text_index.search(
+            table, query, n_candidates * 4, where=where, match_any=True
+        ):
+            if metadata["Id"] not in seen:
+                seen.add(metadata["Id"])
+                lexical_ranking.append((metadata, snippet))
+
+        scores, results = {}, {}
+        for ranking in (lexical_ranking, vector_ranking):
+            for rank, (metadata, preview) in enumerate(ranking[:n_candidates]):
+                id = metadata["Id"]
+                scores[id] = scores.get(id, 0.0) + 1 / (k + rank + 1)
+                results.setdefault(id, (metadata, preview))
+        best = sorted(scores, key=scores.get, reverse=True)[:n_results]
+        return [(*results[id], scores[id]) for id in best]
+
+    def files_hybrid_search(
+        self,
+        query: str,
+        n_results: int = 10,
+        filters: dict = None,
+        time_filter: dict = None,
+    ):
+        """
+        Search the attachments chunks with the vector and the lexical index
+        at once, see _hybrid.
+
+        Parameters:
+            query (str): Search query.
+            n_results (int): Number of retrieved records.
+            filters (dict): Metadata filters.
+            time_filter (dict): CreatedTimestamp range, see time_filters.
+        """
+
+        results_list = []
+        try:
+            matching_docs = self._hybrid(
+                self.files_semantic_collection,
+                "chunks",
+                query,
+                n_results,
+                where=self.combine_filters(filters, time_filter),
+            )
+            for metadata, preview, score in matching_docs:
+                metadata.pop("fingerprint", None)
+                metadata["preview"] = (preview[:300] + "...").replace("\n", "")
+                metadata["score"] = score
+                metadata[
+                    "url"
+                ] = f"http://0.0.0.0:8000/records/download?id={metadata['Id']}"
+                results_list.append(metadata)
+        except Exception as e:
+            print(f"Error: {e}")
+        return results_list
+
+    def assets_hybrid_search(self, query: str, n_results: int = 10):
+        """
+        Search the assets with the vector and the lexical index at once, see
+        _hybrid.
+        """
+
+        results_list = []
+        try:
+            matching_assets = self._hybrid(
+                self.assets_semantic_collection, "assets", query, n_results
+            )
+            for metadata, preview, score in matching_assets:
+                metadata.pop("fingerprint", None)
+                metadata["preview"] = (preview + "...").replace("\n", "")
+                metadata["score"] = score
+                results_list.append(metadata)
+        except Exception as e:
+            print(f"Error: {e}")
+        return results_list
+
+    def file_metadata(self, id: str):
+        """
+        Return the metadata of an ingested file from the local exact
+        collection, or None when it is not there.
+
+        Parameters:
+            id (str): Salesforce record ID.
+        """
+
+        entries = self.files_exact_collection.get(ids=[id], include=["metadatas"])
+        if not entries["ids"]:
+            return None
+        return entries["metadatas"][0]
+
     def chatbot(self, query: str):
         vector_store = ChromaVectorStore(
             chroma_collection=self.files_semantic_collection
         )
 
+    def _write_changed(self, collection, record_ids, ids, documents, metadatas):
+        """
+        Upsert only the entries whose fingerprint changed and delete the
+        entries of the same records that no longer exist (e.g. a file that
+        now splits into fewer chunks). Return the number of entries written
+        or deleted.
+
+        Parameters:
+            collection: Chroma collection.
+            record_ids (List[str]): Salesforce records IDs being written.
+            ids (List[str]): Entries IDs.
+            documents (List[str]): Entries text.
+            metadatas (List[dict]): Entries metadata.
+        """
+
+        metadatas = [
+            {**metadata, "fingerprint": fingerprint(document, metadata)}
+            for document, metadata in zip(documents, metadatas)
+        ]
+        existing = collection.get(
+            where={"Id": {"$in": list(record_ids)}}, include=["metadatas"]
+        )
+        existing = {
+            id: metadata.get("fingerprint")
+            for id, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+        stale = sorted(set(existing) - set(ids))
+        if stale:
+            collection.delete(ids=stale)
+        changed = [
+            i
+            for i, id in enumerate(ids)
+            if existing.get(id) != metadatas[i]["fingerprint"]
+        ]
+        for start in range(0, len(changed), self.embedding_batch_size):
+            batch = changed[start : start + self.embedding_batch_size]
+            collection.upsert(
+                ids=[ids[i] for i in batch],
+                documents=[documents[i] for i in batch],
+                metadatas=[metadatas[i] for i in batch],
+            )
+        return len(changed) + len(stale)
+
+    def _upsert_files(
+        self,
+        documents,
+        chunk_size: int,
+        chunk_overlap: int,
+        semantic: bool = True,
+        exact: bool = True,
+    ):
+        """
+        Upsert the files into the files collections, writing only the chunks
+        that changed. Chunk ids are stable: the record Id and the chunk ordinal.
+        Other versions of the same ContentDocument are removed, so the records
+        must be the latest versions (IsLatest = true).
+
+        Parameters:
+            documents (List[Document]): Records text and metadata.
+            chunk_size (int): The size of each chunk in bytes.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            semantic (bool): Write to the semantic collection.
+            exact (bool): Write to the exact collection.
+        """
+
+        ids = [doc.metadata["Id"] for doc in documents]
+        document_ids = [
+            doc.metadata["ContentDocumentId"]
+            for doc in documents
+            if doc.metadata.get("ContentDocumentId")
+        ]
+        collections = []
+        if semantic:
+            collections.append(self.files_semantic_collection)
+        if exact:
+            collections.append(self.files_exact_collection)
+        if document_ids:
+            for collection in collections:
+                collection.delete(
+                    where={
+                        "$and": [
+                            {"ContentDocumentId": {"$in": document_ids}},
+                            {"Id": {"$nin": ids}},
+                        ]
+                    }
+                )
+
+        if document_ids:
+            # Keep the asset index in step with files attached to known articles.
+            links = self.sf.get_document_links(document_ids, By="ContentDocumentId")
+            asset_ids = self.asset_index.asset_ids(asset_id for _, asset_id in links)
+            self.asset_index.set_document_links(
+                document_ids, [link for link in links if link[1] in asset_ids]
+            )
+
+        written = 0
+        if semantic:
+            splits_id, splits_text, splits_metadata = [], [], []
+            for doc in documents:
+                # Chunks come split from the parser, text from the cache is
+                # split the same way here.
+                chunks = doc.chunks
+                if chunks is None:
+                    chunks = extraction.iter_chunks(
+                        [doc.page_content], chunk_size, chunk_overlap
+                    )
+                for ordinal, chunk in enumerate(chunks):
+                    splits_id.append(f"{doc.metadata['Id']}-{ordinal}")
+                    splits_text.append(chunk)
+                    splits_metadata.append(dict(doc.metadata))
+            written += self._write_changed(
+                self.files_semantic_collection,
+                ids,
+                splits_id,
+                splits_text,
+                splits_metadata,
+            )
+            # Chunks get the same lexical index for hybrid search.
+            self.text_index.delete_records("chunks", ids)
+            if document_ids:
+                self.text_index.delete_where(
+                    "chunks", {"ContentDocumentId": {"$in": document_ids}}
+                )
+            self.text_index.upsert("chunks", splits_id, splits_text, splits_metadata)
+        if exact:
+            written += self._write_changed(
+                self.files_exact_collection,
+                ids,
+                ids,
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents],
+            )
+            if document_ids:
+                self.text_index.delete_where(
+                    "files", {"ContentDocumentId": {"$in": document_ids}}
+                )
+            self.text_index.upsert(
+                "files",
+                ids,
+                [doc.page_content for doc in documents],
+                [doc.metadata for doc in documents],
+            )
+        return written
+
+    def _upsert_assets(self, records, semantic: bool = True, exact: bool = True):
+        """
+        Upsert the Knowledge articles into the assets collections, writing
+        only the articles that changed, and refresh their fields and linked
+        files in the asset index.
+
+        Parameters:
+            records (List[dict]): Knowledge articles fields.
+            semantic (bool): Write to the semantic assets collection.
+            exact (bool): Write to the exact assets collection.
+        """
+
+        ids = [record["Id"] for record in records]
+        assets = [self._asset_document(record) for record in records]
+        assets = [asset for asset in assets if asset is not None]
+        collections = []
+        if semantic:
+            collections.append(self.assets_semantic_collection)
+        if exact:
+            collections.append(self.assets_exact_collection)
+
+        written = 0
+        for collection in collections:
+            written += self._write_changed(
+                collection,
+                ids,
+                [metadata["Id"] for _, metadata in assets],
+                [text for text, _ in assets],
+                [metadata for _, metadata in assets],
+            )
+        if exact:
+            self.text_index.delete("assets", ids)
+            self.text_index.upsert(
+                "assets",
+                [metadata["Id"] for _, metadata in assets],
+                [text for text, _ in assets],
+                [metadata for _, metadata in assets],
+            )
+        links = self.sf.get_document_links(ids)
+        self.asset_index.upsert_assets(records, links)
+        return written
+
+    def _write_files(
+        self,
+        records,
+        chunk_size: int,
+        chunk_overlap: int,
+        semantic: bool = True,
+        exact: bool = True,
+    ):
+        """
+        Stream the records through the ingestion pipeline into the files
+        collections, embedding and writing them in batches while the next
+        ones download. Return the IDs written, the number of collection
+        entries that changed and whether every record made it.
+
+        Parameters:
+            records (iterable of dict): Records metadata.
+            chunk_size (int): The size of each chunk in bytes.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            semantic (bool): Write to the semantic collection.
+            exact (bool): Write to the exact collection.
+        """
+
+        writer = BatchWriter(
+            lambda batch: self._upsert_files(
+                batch, chunk_size, chunk_overlap, semantic=semantic, exact=exact
+            ),
+            batch_size=self.write_batch_size,
+            max_pending=self.write_queue_size,
+            key=lambda doc: doc.metadata["Id"],
+        )
+        stats = IngestionStats()
+        documents = self.pipeline.run(
+            records,
+            stats,
+            chunk_size=chunk_size if semantic else None,
+            chunk_overlap=chunk_overlap,
+            whole_text=exact,
+        )
+        try:
+            with writer:
+                for doc in documents:
+                    writer.put(doc)
+        finally:
+            engine = self._embedding_engine()
+            if engine:
+                engine.report()
+            self._close_embedding_engine()
+        complete = writer.failed == 0 and stats.failed == 0
+        return writer.written_ids, writer.changed, complete
+
+    def _write_assets(self, records, semantic: bool = True, exact: bool = True):
+        """
+        Write the Knowledge articles into the assets collections in batches.
+        Return the IDs written, the number of collection entries that changed
+        and whether every batch made it.
+
+        Parameters:
+            records (iterable of dict): Knowledge articles fields.
+            semantic (bool): Write to the semantic assets collection.
+            exact (bool): Write to the exact assets collection.
+        """
+
+        writer = BatchWriter(
+            lambda batch: self._upsert_assets(batch, semantic=semantic, exact=exact),
+            batch_size=self.write_batch_size,
+            max_pending=self.write_queue_size,
+            key=lambda record: record["Id"],
+        )
+        try:
+            with writer:
+                for record in records:
+                    writer.put(record)
+        finally:
+            self._close_embedding_engine()
+        return writer.written_ids, writer.changed, writer.failed == 0
+
+    def _delete_records(self, ids):
+        """
+        Delete records from all four collections, the full-text and asset
+        indexes, the text cache and the downloaded files cache.
+
+        Parameters:
+            ids (List[str]): Salesforce records IDs.
+        """
+
+        for start in range(0, len(ids), 500):
+            batch = ids[start : start + 500]
+            for collection in (
+                self.files_semantic_collection,
+                self.files_exact_collection,
+                self.assets_semantic_collection,
+                self.assets_exact_collection,
+            ):
+                collection.delete(where={"Id": {"$in": batch}})
+        self.text_index.delete("files", ids)
+        self.text_index.delete("assets", ids)
+        self.asset_index.delete(ids)
+        self.text_index.delete_records("chunks", ids)
+        if self.text_cache:
+            for id in ids:
+                self.text_cache.delete(id)
+        if self.sf and self.sf.blobs:
+            for id in ids:
+                self.sf.blobs.delete(id)
+
+    def _deleted_ids(self, From: str, Where: str, watermark: str, known_ids: set):
+        """
+        Get the known records deleted since the watermark with getDeleted,
+        falling back to comparing the known IDs with a listing of the current
+        ones. getDeleted reports every deleted record of the object, so only
+        the known IDs are kept.
+        """
+
+        if watermark:
+            end = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            try:
+                return known_ids & set(self.sf.get_deleted_ids(From, watermark, end))
+            except Exception as e:
+                logging.warning(f"getDeleted failed for {From} ({e}), listing IDs.")
+        if not known_ids:
+            return set()
+        current_ids = self.sf.get_records_ids(From=From, Where=Where)
+        if current_ids is None:
+            return set()
+        return known_ids - set(current_ids)
+
+    def _sync(
+        self,
+        metadata: List[str],
+        From: str,
+        Where: str,
+        write,
+        upsert: bool = True,
+        delete: bool = True,
+    ):
+        """
+        Pull the records changed since the watermark through write, which
+        returns the IDs written, the number of collection entries that changed
+        and whether every record made it, then remove the deleted records and
+        save the new watermark. The watermark is inclusive, so the last record
+        comes back on every sync and is only counted if something changed.
+        """
+
+        key = self._sync_key(From, Where)
+        state = self.sync_state.get(key)
+        watermark, known_ids = state["watermark"], state["ids"]
+        new_watermark = watermark
+        upserted, deleted = 0, 0
+
+        if upsert:
+            changed_where = Where
+            if watermark:
+                since = f"SystemModstamp >= {watermark}"
+                changed_where = f"({Where}) AND {since}" if Where else since
+            records = self._stream_records(
+                metadata, From, changed_where, OrderBy="SystemModstamp"
+            )
+            ids, upserted, complete = write(records)
+            known_ids.update(ids)
+            # Keep the old watermark if a record failed so it is retried.
+            if records.watermark and complete:
+                new_watermark = records.watermark
+
+        if delete:
+            deleted_ids = sorted(self._deleted_ids(From, Where, watermark, known_ids))
+            if deleted_ids:
+                self._delete_records(deleted_ids)
+            deleted = len(deleted_ids)
+            known_ids.difference_update(deleted_ids)
+
+        self.sync_state.set(key, watermark=new_watermark, ids=known_ids)
+        if upserted or deleted:
+            self.bump_generation()
+        self.records_ids = sorted(known_ids)
+        logging.info(
+            f"synced {From}: {upserted} entries upserted, {deleted} records deleted, "
+            f"watermark {new_watermark}"
+        )
+        return {"upserted": upserted, "deleted": deleted, "watermark": new_watermark}
+
+    def sync_files(
+        self,
+        metadata: List[str] = ["Id", "Title"],
+        chunk_size: int = 1000,
+        chunk_overlap: int = 20,
+        From: str = "",
+        Where: str = "",
+        upsert: bool = True,
+        delete: bool = True,
+    ):
+        """
+        Incrementally sync files with Salesforce using the persisted
+        SystemModstamp watermark: only records changed since the last sync
+        are pulled and upserted, and deleted records are removed from every
+        collection.
+
+        Parameters:
+            metadata (List[str]): List of metadata fields to retrieve.
+            chunk_size (int): The size of each chunk in bytes.
+            chunk_overlap (int): The size of the overlap between adjacent chunks.
+            From (str): Salesforce object name.
+            Where (str): Where clause.
+            upsert (bool): Pull new and edited records.
+            delete (bool): Remove deleted records.
+        """
+
+        return self._sync(
+            metadata,
+            From,
+            Where,
+            lambda records: self._write_files(records, chunk_size, chunk_overlap),
+            upsert=upsert,
+            delete=delete,
+        )
+
+    def sync_assets(
+        self,
+        metadata: List[str] = ["Id", "Title"],
+        From: str = "",
+        Where: str = "",
+        upsert: bool = True,
+        delete: bool = True,
+    ):
+        """
+        Incrementally sync Knowledge articles with Salesforce, see sync_files.
+
+        Parameters:
+            metadata (List[str]): List of metadata fields to retrieve, must include
+                'KnowledgeArticleId' and 'Summary'.
+            From (str): Salesforce object name.
+            Where (str): Where clause.
+            upsert (bool): Pull new and edited records.
+            delete (bool): Remove deleted records.
+        """
+
+        return self._sync(
+            metadata, From, Where, self._write_assets, upsert=upsert, delete=delete
+        )
+
     def add_document(
         self,
+        metadata: List[str] = ["Id", "Title"],
         chunk_size: int = 1000,
         chunk_overlap: int = 20,
         From: str = "",
@@ -570,63 +1512,26 @@ class Vector_Store:
         Limit: str = "",
     ):
         """
-        Track new files uploaded to salesforce and pull them.
+        Track new and edited files on salesforce and pull them, see sync_files.
 
         Parameters:
+            metadata (List[str]): List of metadata fields to retrieve, the same
+                as the ingest and sync of the source.
             chunk_size (bytes): The size of each chunk.
             chunk_overlap: Chunk overlap size.
             From (str): Salesforce object name.
             Where (str): Where clause.
-            OrderBy (str): Order by clause.
-            Limit (str): Limit clause.
+            OrderBy (str): Unused, kept for compatibility.
+            Limit (str): Unused, kept for compatibility.
         """
         try:
-            old_ids = self.records_ids.copy()
-            self.records_ids = []
-            self.records_ids = self.sf.get_records_ids(
-                From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
-            )
-            new_ids = set(self.records_ids) - set(old_ids)
-
-            documents = []
-            for id in new_ids:
-                record_bytes = self.sf.get_record_by_id(id)
-                if self.bytes_to_string(record_bytes):
-                    record_text = self.bytes_to_string(record_bytes)
-                else:
-                    continue
-                record_metadata = self.sf.get_metadata_by_id(
-                    id,
-                    metadata_fields=[
-                        "Id",
-                        "CreatedById",
-                        "CreatedDate",
-                        "Title",
-                        "FileType",
-                    ],
-                    From=From,
-                )
-
-                # create document
-                doc = Document(page_content=record_text, metadata=record_metadata)
-                self.files_semantic_collection.add
-                documents.append(doc)
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size, chunk_overlap=chunk_overlap
-            )
-            splits = text_splitter.split_documents(documents)
-            splits_text = [splits[i].page_content for i in range(len(splits))]
-            splits_metadata = [splits[i].metadata for i in range(len(splits))]
-            splits_id = [
-                str(i)
-                for i in range(
-                    self.files_semantic_collection.count(),
-                    (len(splits)) + self.files_semantic_collection.count(),
-                    1,
-                )
-            ]
-            self.files_semantic_collection.add(
-                ids=splits_id, documents=splits_text, metadatas=splits_metadata
+            return self.sync_files(
+                metadata=metadata,
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                From=From,
+                Where=Where,
+                delete=False,
             )
         except Exception as e:
             logging.exception("No new uploaded files on salesforce.")
@@ -635,23 +1540,16 @@ class Vector_Store:
         self, From: str = "", Where: str = "", OrderBy: str = "", Limit: str = ""
     ):
         """
-        Delete a document from the vector store when it's deleted from salesforce.
+        Delete documents from the vector store when they're deleted from
+        salesforce, see sync_files.
 
         Parameters:
             From (str): Salesforce object name.
             Where (str): Where clause.
-            OrderBy (str): Order by clause.
-            Limit (str): Limit clause.
+            OrderBy (str): Unused, kept for compatibility.
+            Limit (str): Unused, kept for compatibility.
         """
         try:
-            old_ids = self.records_ids.copy()
-            self.records_ids = []
-            self.records_ids = self.sf.get_records_ids(
-                From=From, Where=Where, OrderBy=OrderBy, Limit=Limit
-            )
-            deleted_ids = set(old_ids) - set(self.records_ids)
-            for id in deleted_ids:
-                self.files_semantic_collection.delete(where={"Id": f"{id}"})
-
+            return self.sync_files(From=From, Where=Where, upsert=False)
         except Exception as e:
             logging.exception("No new deleted files on salesforce.")
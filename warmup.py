@@ -0,0 +1,70 @@
+import time
+import logging
+import threading
+
+
+class WarmUp:
+    def __init__(self, steps):
+        """
+        Run the slow start-up steps (model loading, index initialisation) one
+        after the other in a background thread, so the server accepts
+        connections right away, and report their progress.
+
+        Parameters:
+            steps (List[tuple]): (name, callable) pairs, run in order.
+        """
+
+        self.steps = steps
+        self.state = "pending"
+        self.current = None
+        self.durations = {}
+        self.error = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def _run(self):
+        self.state = "running"
+        for name, step in self.steps:
+            self.current = name
+            started = time.monotonic()
+            try:
+                step()
+            except Exception as e:
+                self.state = "failed"
+                self.error = f"{name}: {e}"
+                logging.exception(f"Warm-up step {name} failed.")
+                return
+            self.durations[name] = round(time.monotonic() - started, 3)
+            logging.info(f"warm-up step {name} done in {self.durations[name]}s")
+        self.current = None
+        self.state = "ready"
+
+    def start(self):
+        """
+        Start the background thread.
+        """
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def status(self):
+        """
+        Return the state of the warm-up and the steps done so far.
+        """
+
+        return {
+            "state": self.state,
+            "current_step": self.current,
+            "done": list(self.durations),
+            "pending": [
+                name
+                for name, _ in self.steps
+                if name not in self.durations and name != self.current
+            ],
+            "seconds": self.durations,
+            "error": self.error,
+        }